@@ -0,0 +1,124 @@
+import time
+from collections import namedtuple
+
+from alerter import evaluator as default_evaluator
+from config import ALERT_HYSTERESIS, ALERT_MIN_DURATION
+from metrics import timed
+
+
+class AlertEvent(
+    namedtuple("AlertEvent", "kind site metric condition value limit timestamp")
+):
+    """A raised or cleared transition for one metric at one site."""
+
+    __slots__ = ()
+
+    @property
+    def tip_key(self):
+        """The HEALTH_TIPS key for this alert, e.g. "high_co2"."""
+        return f"{self.condition}_{self.metric}"
+
+
+class _SeriesState:
+    __slots__ = ("active", "pending_condition", "pending_since")
+
+    def __init__(self):
+        self.active = None  # the AlertEvent that raised the current alert
+        self.pending_condition = None
+        self.pending_since = 0.0
+
+
+class AlertEngine:
+    """Turns a stream of readings into raised/cleared alert transitions.
+
+    ``site`` is a site id; it selects both the series state and the site's
+    thresholds.
+
+    Each (site, metric) series keeps a few fields of state, so a reading costs
+    the same no matter how much history came before it:
+
+    - a breach must persist for ``min_duration`` seconds before it is raised;
+    - once raised, it clears only after the value moves back past the limit by
+      ``hysteresis`` (a fraction of the limit), so noise around the limit does
+      not flap;
+    - while an alert stays active, repeated breaches emit nothing.
+    """
+
+    def __init__(
+        self,
+        evaluator=default_evaluator,
+        hysteresis=ALERT_HYSTERESIS,
+        min_duration=ALERT_MIN_DURATION,
+    ):
+        self.evaluator = evaluator
+        self.hysteresis = hysteresis
+        self.min_duration = min_duration
+        self._states = {}
+
+    @timed("alert_engine")
+    def process(self, reading, site=None, timestamp=None):
+        """Feeds one reading and returns the transitions it caused."""
+        if timestamp is None:
+            timestamp = time.time()
+        events = []
+        for metric, low, high in self.evaluator.limits(site):
+            value = reading.get(metric)
+            if value is None:
+                continue
+            state = self._states.get((site, metric))
+            if state is None:
+                state = self._states[(site, metric)] = _SeriesState()
+
+            active = state.active
+            if active is not None:
+                if self._still_breached(active.condition, value, active.limit):
+                    continue
+                events.append(
+                    active._replace(kind="cleared", value=value, timestamp=timestamp)
+                )
+                state.active = None
+
+            if high is not None and value > high:
+                condition, limit = "high", high
+            elif low is not None and value < low:
+                condition, limit = "low", low
+            else:
+                state.pending_condition = None
+                continue
+
+            if state.pending_condition != condition:
+                state.pending_condition = condition
+                state.pending_since = timestamp
+            if timestamp - state.pending_since >= self.min_duration:
+                state.active = AlertEvent(
+                    "raised", site, metric, condition, value, limit, timestamp
+                )
+                state.pending_condition = None
+                events.append(state.active)
+        return events
+
+    def _still_breached(self, condition, value, limit):
+        band = abs(limit) * self.hysteresis
+        if condition == "high":
+            return value > limit - band
+        return value < limit + band
+
+    def is_alerting(self, site=None):
+        """Returns True if any metric at the site has an active alert."""
+        return any(
+            state.active is not None
+            for (state_site, _), state in self._states.items()
+            if state_site == site
+        )
+
+    def active_alerts(self, site=None):
+        """Returns the raising event of every alert currently active at a site."""
+        return [
+            state.active
+            for (state_site, _), state in self._states.items()
+            if state_site == site and state.active is not None
+        ]
+
+    def reset(self):
+        """Forgets all per-series state."""
+        self._states.clear()
@@ -1,32 +1,172 @@
-from config import DEFAULT_THRESHOLDS
-from db_handler import get_thresholds
-
-def check_thresholds(latest_data):
-    """Checks the latest data against safety thresholds and returns alerts."""
-    alerts = []
-    user_thresholds = get_thresholds()
-
-    # Merge user thresholds with defaults, giving user settings precedence
-    thresholds = DEFAULT_THRESHOLDS.copy()
-    for metric, values in user_thresholds.items():
-        if metric in thresholds:
-            thresholds[metric].update(values)
-        else:
-            thresholds[metric] = values
-
-    for metric, value in latest_data.items():
-        if value is None:
+import time
+from collections import namedtuple
+
+from config import DEFAULT_THRESHOLDS, THRESHOLDS_CHECK_INTERVAL
+from db_handler import (
+    DEFAULT_SITE_ID,
+    get_historical_columns,
+    get_thresholds,
+    thresholds_version,
+)
+from metrics import timed
+
+
+class Alert(namedtuple("Alert", "metric condition value limit")):
+    """A single threshold breach. ``condition`` is "high" or "low"."""
+
+    __slots__ = ()
+
+    @property
+    def tip_key(self):
+        """The HEALTH_TIPS key for this breach, e.g. "high_co2"."""
+        return f"{self.condition}_{self.metric}"
+
+    def __str__(self):
+        return format_alert(self)
+
+
+def format_alert(alert):
+    """Formats an alert for display."""
+    if alert.condition == "high":
+        return (
+            f"ALERT: {alert.metric.capitalize()} is too high: "
+            f"{alert.value:.2f} > {alert.limit}"
+        )
+    return (
+        f"ALERT: {alert.metric.capitalize()} is too low: "
+        f"{alert.value:.2f} < {alert.limit}"
+    )
+
+
+class ThresholdEvaluator:
+    """Checks readings against thresholds merged once into a flat table per site.
+
+    The tables are rebuilt when the stored thresholds version changes, which
+    set_threshold bumps in this process or another. The version is read at
+    most once every ``check_interval`` seconds, so evaluating a reading
+    usually touches no database at all. With ``check_interval=None`` only
+    refresh checks it, for callers that schedule the check themselves.
+    """
+
+    def __init__(self, check_interval=THRESHOLDS_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._limits = {}
+        self._version = None
+        self._checked = None
+
+    def invalidate(self):
+        """Forces the thresholds to be reloaded on the next evaluation."""
+        self._limits = {}
+        self._version = None
+        self._checked = None
+
+    def refresh(self, site_ids=()):
+        """Reloads the tables if the thresholds changed, and loads ``site_ids``."""
+        version = thresholds_version()
+        self._checked = time.monotonic()
+        if version != self._version:
+            # Built aside and swapped in, so a reader never finds a table missing
+            site_ids = set(site_ids) | set(self._limits)
+            self._limits = {site_id: self._load(site_id) for site_id in site_ids}
+            self._version = version
+            return
+        for site_id in site_ids:
+            if site_id not in self._limits:
+                self._limits[site_id] = self._load(site_id)
+
+    def limits(self, site_id=None):
+        """Returns the merged ``(metric, min, max)`` table for a site.
+
+        Site thresholds override the global ones, which override
+        DEFAULT_THRESHOLDS. ``site_id=None`` gives the global table.
+        """
+        if self.check_interval is not None and (
+            self._checked is None
+            or time.monotonic() - self._checked >= self.check_interval
+        ):
+            self.refresh()
+        limits = self._limits.get(site_id)
+        if limits is None:
+            limits = self._limits[site_id] = self._load(site_id)
+        return limits
+
+    def _load(self, site_id):
+        # Copy the nested dicts so user overrides never leak into the defaults
+        merged = {metric: dict(limits) for metric, limits in DEFAULT_THRESHOLDS.items()}
+        for metric, values in get_thresholds(site_id).items():
+            limits = merged.setdefault(metric, {})
+            for bound, value in values.items():
+                if value is not None:
+                    limits[bound] = value
+        return tuple(
+            (metric, limits.get("min"), limits.get("max"))
+            for metric, limits in merged.items()
+        )
+
+    def evaluate(self, reading, site_id=None):
+        """Returns an Alert for every limit the reading breaches."""
+        alerts = []
+        for metric, low, high in self.limits(site_id):
+            value = reading.get(metric)
+            if value is None:
+                continue
+            if high is not None and value > high:
+                alerts.append(Alert(metric, "high", value, high))
+            if low is not None and value < low:
+                alerts.append(Alert(metric, "low", value, low))
+        return alerts
+
+
+evaluator = ThresholdEvaluator()
+
+
+@timed("check_thresholds")
+def check_thresholds(latest_data, site_id=None):
+    """Checks the latest data against safety thresholds and returns alerts.
+
+    Uses the thresholds of ``site_id``, or of the reading's own ``site_id``.
+    """
+    if site_id is None:
+        site_id = latest_data.get("site_id")
+    return evaluator.evaluate(latest_data, site_id)
+
+
+MetricBreaches = namedtuple("MetricBreaches", "metric high low count first last")
+
+
+def evaluate_columns(columns, limits=None):
+    """Checks columnar readings against every limit at once.
+
+    ``columns`` is the dict returned by get_historical_columns. Returns a
+    MetricBreaches per metric present, holding boolean ``high``/``low`` masks,
+    the total breach count and the first and last breach timestamps (None
+    when there were no breaches). NaN values never count as breaches.
+    """
+    import numpy as np
+
+    timestamps = columns["timestamp"]
+    results = {}
+    for metric, low, high in limits if limits is not None else evaluator.limits():
+        values = columns.get(metric)
+        if values is None:
             continue
+        # Comparisons against NaN are False, so missing readings drop out here
+        no_limit = np.zeros(len(values), dtype=bool)
+        high_mask = values > high if high is not None else no_limit
+        low_mask = values < low if low is not None else no_limit
+        breached = np.flatnonzero(high_mask | low_mask)
+        results[metric] = MetricBreaches(
+            metric,
+            high_mask,
+            low_mask,
+            len(breached),
+            timestamps[breached[0]] if len(breached) else None,
+            timestamps[breached[-1]] if len(breached) else None,
+        )
+    return results
+
 
-        if metric in thresholds:
-            limits = thresholds[metric]
-            if "max" in limits and value > limits["max"]:
-                alerts.append(
-                    f"ALERT: {metric.capitalize()} is too high: {value:.2f} > {limits['max']}"
-                )
-            if "min" in limits and value < limits["min"]:
-                alerts.append(
-                    f"ALERT: {metric.capitalize()} is too low: {value:.2f} < {limits['min']}"
-                )
-
-    return alerts
\ No newline at end of file
+def check_thresholds_range(start_date, end_date, site_id=DEFAULT_SITE_ID):
+    """Finds every threshold breach at a site in a date range using vectorized checks."""
+    columns = get_historical_columns(start_date, end_date, site_id=site_id)
+    return evaluate_columns(columns, evaluator.limits(site_id))
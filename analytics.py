@@ -0,0 +1,286 @@
+import math
+from bisect import bisect_left
+from collections import namedtuple
+
+# AQI breakpoints per scale and pollutant as (conc_low, conc_high, aqi_low,
+# aqi_high) rows; concentrations are µg/m³. "us" is the US EPA table (PM2.5
+# as revised in 2024), "cn" is China's HJ 633-2012 table, which AirVisual's
+# aqicn follows.
+AQI_BREAKPOINTS = {
+    "us": {
+        "pm25": (
+            (0.0, 9.0, 0, 50),
+            (9.1, 35.4, 51, 100),
+            (35.5, 55.4, 101, 150),
+            (55.5, 125.4, 151, 200),
+            (125.5, 225.4, 201, 300),
+            (225.5, 325.4, 301, 500),
+        ),
+        "pm10": (
+            (0, 54, 0, 50),
+            (55, 154, 51, 100),
+            (155, 254, 101, 150),
+            (255, 354, 151, 200),
+            (355, 424, 201, 300),
+            (425, 604, 301, 500),
+        ),
+    },
+    "cn": {
+        "pm25": (
+            (0, 35, 0, 50),
+            (35, 75, 50, 100),
+            (75, 115, 100, 150),
+            (115, 150, 150, 200),
+            (150, 250, 200, 300),
+            (250, 350, 300, 400),
+            (350, 500, 400, 500),
+        ),
+        "pm10": (
+            (0, 50, 0, 50),
+            (50, 150, 50, 100),
+            (150, 250, 100, 150),
+            (250, 350, 150, 200),
+            (350, 420, 200, 300),
+            (420, 500, 300, 400),
+            (500, 600, 400, 500),
+        ),
+    },
+}
+
+RollingStats = namedtuple("RollingStats", "mean min max count")
+
+
+def _knots(scale, metric):
+    try:
+        rows = AQI_BREAKPOINTS[scale][metric]
+    except KeyError:
+        raise ValueError(f"No {scale} AQI breakpoints for {metric}") from None
+    concentrations, indexes = [], []
+    for conc_low, conc_high, aqi_low, aqi_high in rows:
+        # Tables that share a bound between bands list it once
+        if not concentrations or conc_low != concentrations[-1]:
+            concentrations.append(conc_low)
+            indexes.append(aqi_low)
+        concentrations.append(conc_high)
+        indexes.append(aqi_high)
+    return concentrations, indexes
+
+
+def _interp(values, xs, ys):
+    """Piecewise-linear lookup, clamped at both ends; NaN stays NaN."""
+    if isinstance(values, (int, float)):
+        if values != values:
+            return math.nan
+        i = min(max(bisect_left(xs, values), 1), len(xs) - 1)
+        x0, x1, y0, y1 = xs[i - 1], xs[i], ys[i - 1], ys[i]
+        value = min(max(values, xs[0]), xs[-1])
+        return y0 + (y1 - y0) * (value - x0) / (x1 - x0) if x1 != x0 else y1
+    import numpy as np
+
+    return np.interp(np.asarray(values, dtype=np.float64), xs, ys)
+
+
+def concentration_to_aqi(metric, concentrations, scale="us"):
+    """Converts pollutant concentrations (µg/m³) to AQI values.
+
+    Accepts a number or an array. Values beyond the top of the table are
+    reported as the table maximum (500).
+    """
+    xs, ys = _knots(scale, metric)
+    return _interp(concentrations, xs, ys)
+
+
+def aqi_to_concentration(metric, aqi, scale="us"):
+    """Converts AQI values back to the pollutant concentration (µg/m³)."""
+    xs, ys = _knots(scale, metric)
+    return _interp(aqi, ys, xs)
+
+
+def _seconds(timestamps):
+    import numpy as np
+
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return timestamps.astype("datetime64[s]").astype(np.float64)
+    return timestamps.astype(np.float64)
+
+
+def _window_seconds(window):
+    return window.total_seconds() if hasattr(window, "total_seconds") else window
+
+
+def _window_starts(seconds, window):
+    """Index of the first reading in each reading's trailing window."""
+    import numpy as np
+
+    return np.searchsorted(seconds, seconds - window, side="right")
+
+
+def _rolling_extreme(values, starts, func):
+    """Applies ``func`` (np.fmin/np.fmax) over values[starts[i]:i + 1] for each i.
+
+    Each window is covered by two overlapping power-of-two spans, so the whole
+    series costs O(n log w) for windows of up to w readings. Only one level of
+    span extremes is held at a time.
+    """
+    import numpy as np
+
+    ends = np.arange(len(values))
+    lengths = ends - starts + 1
+    result = np.empty(len(values), dtype=np.float64)
+    if not len(values):
+        return result
+    levels = np.log2(lengths).astype(np.int64)
+    longest = lengths.max()
+    spans = values  # spans[j] is the extreme of values[j:j + span]
+    span, level = 1, 0
+    while True:
+        at_level = np.flatnonzero(levels == level)
+        result[at_level] = func(
+            spans[starts[at_level]], spans[ends[at_level] - span + 1]
+        )
+        if span * 2 > longest:
+            return result
+        spans = func(spans[:-span], spans[span:])
+        span, level = span * 2, level + 1
+
+
+def rolling_stats(timestamps, values, window):
+    """Trailing-window mean, min, max and count at every reading.
+
+    ``window`` is in seconds (or a timedelta) and must be positive; each
+    reading's window covers the readings in (t - window, t]. Timestamps must
+    be sorted, as returned by get_historical_columns. NaN values are skipped,
+    and a window with no values yields NaN.
+    """
+    import numpy as np
+
+    window = _window_seconds(window)
+    if not window > 0:
+        raise ValueError(f"Rolling window must be positive, got {window}")
+    seconds = _seconds(timestamps)
+    values = np.asarray(values, dtype=np.float64)
+    starts = _window_starts(seconds, window)
+
+    present = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(present, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(present)))
+    ends = np.arange(1, len(values) + 1)
+    count = counts[ends] - counts[starts]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (sums[ends] - sums[starts]) / count
+
+    return RollingStats(
+        mean,
+        _rolling_extreme(values, starts, np.fmin),
+        _rolling_extreme(values, starts, np.fmax),
+        count,
+    )
+
+
+def ewma(timestamps, values, halflife):
+    """Time-weighted exponential moving average at every reading.
+
+    A reading's weight halves every ``halflife`` seconds (or timedelta) of
+    age, so irregular sampling is handled correctly. NaN values are skipped.
+    """
+    import numpy as np
+
+    seconds = _seconds(timestamps)
+    values = np.asarray(values, dtype=np.float64)
+    tau = _window_seconds(halflife) / math.log(2)
+
+    present = ~np.isnan(values)
+    weighted = np.where(present, values, 0.0)
+    weights = present.astype(np.float64)
+    result = np.empty(len(values), dtype=np.float64)
+
+    # Weights grow as exp(t / tau) and the average is a ratio of two weighted
+    # sums, so the series is processed in blocks short enough for exp() not to
+    # overflow, carrying both sums across block boundaries.
+    numerator = denominator = 0.0
+    start = 0
+    while start < len(values):
+        origin = seconds[start]
+        stop = np.searchsorted(seconds, origin + 500 * tau, side="right")
+        scale = np.exp((seconds[start:stop] - origin) / tau)
+        numerators = numerator + np.cumsum(weighted[start:stop] * scale)
+        denominators = denominator + np.cumsum(weights[start:stop] * scale)
+        with np.errstate(invalid="ignore"):
+            result[start:stop] = numerators / denominators
+        if stop < len(values):
+            decay = math.exp((origin - seconds[stop]) / tau)
+            numerator = numerators[-1] * decay
+            denominator = denominators[-1] * decay
+        start = stop
+    return result
+
+
+def percentiles(values, qs=(50, 95, 99)):
+    """Returns {q: value} for the given percentiles, ignoring NaN."""
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    if not np.any(~np.isnan(values)):
+        return {q: None for q in qs}
+    return dict(zip(qs, np.nanpercentile(values, qs).tolist()))
+
+
+def as_columns(readings, metrics):
+    """Turns get_historical_data rows (a list of dicts) into columnar arrays."""
+    import numpy as np
+
+    columns = {
+        "timestamp": np.array(
+            [reading["timestamp"] for reading in readings], dtype="datetime64[s]"
+        )
+    }
+    for metric in metrics:
+        columns[metric] = np.array(
+            [reading.get(metric) for reading in readings], dtype=np.float64
+        )
+    return columns
+
+
+MetricSummary = namedtuple(
+    "MetricSummary", "metric count min mean max percentiles rolling ewma aqi"
+)
+
+
+def summarize(columns, window, halflife, qs=(50, 95, 99)):
+    """Summarizes each metric in ``columns`` (from get_historical_columns).
+
+    Returns a MetricSummary per metric with the range's count, min, mean, max
+    and percentiles, the rolling stats and EWMA at the last reading, and, for
+    PM2.5 and PM10, the US AQI of the last rolling mean.
+    """
+    import numpy as np
+
+    timestamps = columns["timestamp"]
+    summaries = {}
+    for metric, values in columns.items():
+        if metric == "timestamp":
+            continue
+        present = values[~np.isnan(values)]
+        if not len(present):
+            summaries[metric] = MetricSummary(
+                metric, 0, None, None, None, percentiles(present, qs), None, None, None
+            )
+            continue
+        rolling = rolling_stats(timestamps, values, window)
+        last_rolling = RollingStats(*(float(field[-1]) for field in rolling))
+        aqi = None
+        if metric in AQI_BREAKPOINTS["us"] and not math.isnan(last_rolling.mean):
+            aqi = round(concentration_to_aqi(metric, last_rolling.mean))
+        summaries[metric] = MetricSummary(
+            metric,
+            len(present),
+            float(present.min()),
+            float(present.mean()),
+            float(present.max()),
+            percentiles(present, qs),
+            last_rolling,
+            float(ewma(timestamps, values, halflife)[-1]),
+            aqi,
+        )
+    return summaries
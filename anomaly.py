@@ -0,0 +1,222 @@
+import math
+import time
+from array import array
+from collections import namedtuple
+
+from config import (
+    ANOMALY_ALPHA,
+    ANOMALY_CUSUM_DRIFT,
+    ANOMALY_CUSUM_LIMIT,
+    ANOMALY_MIN_SAMPLES,
+    ANOMALY_SAVE_INTERVAL,
+    ANOMALY_SEASONAL_ALPHA,
+    ANOMALY_Z_THRESHOLD,
+)
+from db_handler import METRICS, load_anomaly_state, save_anomaly_state
+
+HOURS = 24
+
+
+class Anomaly(namedtuple("Anomaly", "kind site metric value expected score timestamp")):
+    """An "outlier" or "step" flagged for one metric at one site.
+
+    ``score`` is the z-score of an outlier, or the signed CUSUM total of a
+    step change.
+    """
+
+    __slots__ = ()
+
+
+def format_anomaly(anomaly):
+    """Formats an anomaly for display."""
+    if anomaly.kind == "step":
+        direction = "up" if anomaly.score > 0 else "down"
+        return (
+            f"ANOMALY: {anomaly.metric.capitalize()} shifted {direction}: "
+            f"{anomaly.value:.2f} (baseline {anomaly.expected:.2f})"
+        )
+    return (
+        f"ANOMALY: {anomaly.metric.capitalize()} is unusual: {anomaly.value:.2f} "
+        f"(expected {anomaly.expected:.2f}, z={anomaly.score:+.1f})"
+    )
+
+
+def _weighted_update(mean, var, value, weight):
+    """One step of an exponentially weighted mean and variance."""
+    diff = value - mean
+    return mean + weight * diff, (1 - weight) * (var + weight * diff * diff)
+
+
+class _MetricState:
+    """Running baseline for one (site, metric) series.
+
+    ``mean``/``var`` follow the readings with weight max(1/count, alpha): an
+    exact Welford mean and variance while warming up, an exponentially
+    weighted one afterwards. ``seasonal`` holds the same count, mean and
+    variance for each UTC hour of the day.
+    """
+
+    __slots__ = ("count", "mean", "var", "cusum_high", "cusum_low", "seasonal")
+
+    SIZE = 5 + 3 * HOURS  # doubles in the serialized form
+
+    def __init__(self, values=None):
+        if values is None:
+            values = array("d", bytes(8 * self.SIZE))
+        self.count, self.mean, self.var, self.cusum_high, self.cusum_low = values[:5]
+        self.seasonal = values[5:]
+
+    def to_bytes(self):
+        head = array("d", (self.count, self.mean, self.var))
+        head.extend((self.cusum_high, self.cusum_low))
+        return (head + self.seasonal).tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        values = array("d")
+        values.frombytes(blob)
+        # State saved by a different layout is dropped and relearned
+        return cls(values) if len(values) == cls.SIZE else cls()
+
+
+class AnomalyDetector:
+    """Flags readings that are unusual for their site, metric and time of day.
+
+    Each reading costs a fixed number of arithmetic steps per metric and the
+    state is a fixed 77 doubles per series, so detection can run inline with
+    ingest. A reading is an outlier when it lies more than ``z_threshold``
+    standard deviations from its baseline (the hour-of-day baseline once that
+    hour has enough samples). A two-sided CUSUM over the same z-scores flags
+    step changes that stay within the outlier band; the baseline then
+    re-centres on the new level.
+
+    Outliers are clipped to the band before they update the baseline, so a
+    spike does not drag it along. State is loaded per site on first use and
+    written back by flush().
+    """
+
+    def __init__(
+        self,
+        alpha=ANOMALY_ALPHA,
+        seasonal_alpha=ANOMALY_SEASONAL_ALPHA,
+        min_samples=ANOMALY_MIN_SAMPLES,
+        z_threshold=ANOMALY_Z_THRESHOLD,
+        cusum_drift=ANOMALY_CUSUM_DRIFT,
+        cusum_limit=ANOMALY_CUSUM_LIMIT,
+        save_interval=ANOMALY_SAVE_INTERVAL,
+    ):
+        self.alpha = alpha
+        self.seasonal_alpha = seasonal_alpha
+        self.min_samples = min_samples
+        self.z_threshold = z_threshold
+        self.cusum_drift = cusum_drift
+        self.cusum_limit = cusum_limit
+        self.save_interval = save_interval
+        self._states = {}
+        self._loaded_sites = set()
+        self._dirty = set()
+        self._saved_at = time.monotonic()
+
+    def _load(self, site):
+        for metric, blob in load_anomaly_state(site).items():
+            self._states[(site, metric)] = _MetricState.from_bytes(blob)
+        self._loaded_sites.add(site)
+
+    def process(self, reading, site, timestamp=None):
+        """Feeds one reading and returns the anomalies it shows."""
+        if site not in self._loaded_sites:
+            self._load(site)
+        if timestamp is None:
+            timestamp = time.time()
+        hour = int(timestamp // 3600) % HOURS
+
+        anomalies = []
+        for metric in METRICS:
+            value = reading.get(metric)
+            if value is None:
+                continue
+            state = self._states.get((site, metric))
+            if state is None:
+                state = self._states[(site, metric)] = _MetricState()
+            anomaly = self._update(state, hour, value)
+            if anomaly is not None:
+                kind, expected, score = anomaly
+                anomalies.append(
+                    Anomaly(kind, site, metric, value, expected, score, timestamp)
+                )
+            self._dirty.add((site, metric))
+        return anomalies
+
+    def _update(self, state, hour, value):
+        slot = 3 * hour
+        seasonal = state.seasonal
+        seasonal_ready = seasonal[slot] >= self.min_samples
+        if seasonal_ready:
+            expected, var = seasonal[slot + 1], seasonal[slot + 2]
+        else:
+            expected, var = state.mean, state.var
+        # A floor on the spread keeps near-constant series from flagging
+        # rounding noise as huge z-scores.
+        std = math.sqrt(max(var, (1e-3 * abs(expected)) ** 2, 1e-12))
+
+        anomaly = None
+        if state.count >= self.min_samples:
+            z = (value - expected) / std
+            if abs(z) > self.z_threshold:
+                anomaly = ("outlier", expected, z)
+                limit = self.z_threshold if z > 0 else -self.z_threshold
+                value, z = expected + limit * std, limit
+
+            # Until the hour's own baseline is ready, the daily cycle would read
+            # as drift, so step detection waits for it.
+            if seasonal_ready:
+                state.cusum_high = max(0.0, state.cusum_high + z - self.cusum_drift)
+                state.cusum_low = max(0.0, state.cusum_low - z - self.cusum_drift)
+                if max(state.cusum_high, state.cusum_low) > self.cusum_limit:
+                    if state.cusum_high > state.cusum_low:
+                        score = state.cusum_high
+                    else:
+                        score = -state.cusum_low
+                    anomaly = ("step", expected, score)
+                    # Move every baseline to the new level at once rather than
+                    # flagging readings while they catch up.
+                    shift = value - expected
+                    state.mean += shift
+                    for other in range(0, len(seasonal), 3):
+                        if seasonal[other]:
+                            seasonal[other + 1] += shift
+                    state.cusum_high = state.cusum_low = 0.0
+
+        state.count += 1
+        state.mean, state.var = _weighted_update(
+            state.mean, state.var, value, max(1.0 / state.count, self.alpha)
+        )
+        seasonal[slot] += 1
+        seasonal[slot + 1], seasonal[slot + 2] = _weighted_update(
+            seasonal[slot + 1],
+            seasonal[slot + 2],
+            value,
+            max(1.0 / seasonal[slot], self.seasonal_alpha),
+        )
+        return anomaly
+
+    def flush(self, force=False):
+        """Saves changed state, at most once per ``save_interval`` unless forced."""
+        if not self._dirty:
+            return
+        if not force and time.monotonic() - self._saved_at < self.save_interval:
+            return
+        save_anomaly_state(
+            [
+                (site, metric, self._states[(site, metric)].to_bytes())
+                for site, metric in self._dirty
+            ]
+        )
+        self._dirty.clear()
+        self._saved_at = time.monotonic()
+
+    def reset(self):
+        """Forgets all in-memory state; saved state is reloaded on next use."""
+        self._states.clear()
+        self._loaded_sites.clear()
+        self._dirty.clear()
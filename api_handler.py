@@ -1,13 +1,106 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from analytics import aqi_to_concentration
+from cache import ResponseCache
+from config import (
+    CACHE_DISK_PATH,
+    CACHE_GRID_DEGREES,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTLS,
+    MAX_CONCURRENT_REQUESTS,
+    PROVIDER_QUOTAS,
+)
+from metrics import increment, timed
+from ratelimit import ProviderQuota
+from resilience import ProviderUnavailable, RateLimited, call_with_resilience
+
 load_dotenv()  # Load environment variables from .env
 
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 AIRVISUAL_API_KEY = os.getenv("AIRVISUAL_API_KEY")
 
+# Overridable so the benchmarks can point at a local mock server
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "http://api.openweathermap.org")
+AIRVISUAL_BASE_URL = os.getenv("AIRVISUAL_BASE_URL", "http://api.airvisual.com")
+
+
+def _load_quota(provider, env_prefix):
+    limits = PROVIDER_QUOTAS[provider]
+    return ProviderQuota(
+        provider,
+        float(os.getenv(f"{env_prefix}_CALLS_PER_MINUTE", limits["per_minute"])),
+        float(os.getenv(f"{env_prefix}_CALLS_PER_DAY", limits["per_day"])),
+    )
+
+
+provider_quotas = {
+    "openweather": _load_quota("openweather", "OPENWEATHER"),
+    "airvisual": _load_quota("airvisual", "AIRVISUAL"),
+}
+
+# One keep-alive session per provider, shared by all worker threads
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+response_cache = ResponseCache(
+    CACHE_TTLS, CACHE_GRID_DEGREES, CACHE_MAX_ENTRIES, CACHE_DISK_PATH
+)
+
+
+def _get_session(provider):
+    """Returns the pooled HTTP session for a provider, creating it on first use."""
+    session = _sessions.get(provider)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _sessions[provider] = session
+    return session
 
+
+def _retry_after(response, default=60.0):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        return default
+
+
+def _get_json(provider, url, timeout):
+    """Performs a single GET on the provider's session and decodes the body."""
+    quota = provider_quotas[provider]
+    if not quota.acquire(timeout):
+        raise RateLimited(f"{provider} call quota is used up for now.")
+    response = _get_session(provider).get(url, timeout=timeout)
+    if response.status_code == 429:
+        quota.block_for(_retry_after(response))
+    response.raise_for_status()  # Raise an exception for bad status codes
+    return response.json()
+
+
+def _is_retryable(error):
+    """Returns True for transient failures worth another attempt."""
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(
+        error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    )
+
+
+@timed("get_weather_data")
 def get_weather_data(lat, lon):
     """Fetches weather data from OpenWeatherMap."""
     if not OPENWEATHER_API_KEY:
@@ -15,19 +108,35 @@ def get_weather_data(lat, lon):
             "OpenWeatherMap API key not found. Please set OPENWEATHER_API_KEY in your .env file."
         )
 
-    url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
+    cached = response_cache.get("openweather", lat, lon)
+    if cached is not None:
+        increment("cache_hits_total", provider="openweather")
+        return cached
+    increment("cache_misses_total", provider="openweather")
+
+    url = f"{OPENWEATHER_BASE_URL}/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
     try:
-        response = requests.get(url, timeout=5000)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()
-    except requests.exceptions.JSONDecodeError:
-        print(f"Error decoding JSON from weather API. Response text: {response.text}")
+        data = call_with_resilience(
+            "openweather", partial(_get_json, "openweather", url), _is_retryable
+        )
+    except ProviderUnavailable as e:
+        print(f"Weather data unavailable: {e}")
+        increment("errors_total", stage="get_weather_data")
+        return None
+    except requests.exceptions.JSONDecodeError as e:
+        print(f"Error decoding JSON from weather API. Response text: {e.doc}")
+        increment("errors_total", stage="get_weather_data")
         return None
     except requests.exceptions.RequestException as e:
         print(f"Error fetching weather data: {e}")
+        increment("errors_total", stage="get_weather_data")
         return None
 
+    response_cache.set("openweather", lat, lon, data)
+    return data
+
 
+@timed("get_air_quality_data")
 def get_air_quality_data(lat, lon):
     """Fetches air quality data from AirVisual."""
     if not AIRVISUAL_API_KEY:
@@ -35,25 +144,36 @@ def get_air_quality_data(lat, lon):
             "AirVisual API key not found. Please set AIRVISUAL_API_KEY in your .env file."
         )
 
-    url = f"http://api.airvisual.com/v2/nearest_city?lat={lat}&lon={lon}&key={AIRVISUAL_API_KEY}"
+    cached = response_cache.get("airvisual", lat, lon)
+    if cached is not None:
+        increment("cache_hits_total", provider="airvisual")
+        return cached
+    increment("cache_misses_total", provider="airvisual")
+
+    url = f"{AIRVISUAL_BASE_URL}/v2/nearest_city?lat={lat}&lon={lon}&key={AIRVISUAL_API_KEY}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.JSONDecodeError:
-        print(f"Error decoding JSON from AirVisual API. Response text: {response.text}")
+        data = call_with_resilience(
+            "airvisual", partial(_get_json, "airvisual", url), _is_retryable
+        )
+    except ProviderUnavailable as e:
+        print(f"Air quality data unavailable: {e}")
+        increment("errors_total", stage="get_air_quality_data")
+        return None
+    except requests.exceptions.JSONDecodeError as e:
+        print(f"Error decoding JSON from AirVisual API. Response text: {e.doc}")
+        increment("errors_total", stage="get_air_quality_data")
         return None
     except requests.exceptions.RequestException as e:
         print(f"Error fetching air quality data: {e}")
+        increment("errors_total", stage="get_air_quality_data")
         return None
 
+    response_cache.set("airvisual", lat, lon, data)
+    return data
 
-def fetch_and_parse_data(lat=35.6895, lon=139.6917):  # Default to Tokyo
-    """Fetches and parses data from all configured APIs."""
-    weather_raw = get_weather_data(lat, lon)
-    air_quality_raw = get_air_quality_data(lat, lon)
 
-    # --- Parse and combine data into a standardized format ---
+def parse_readings(weather_raw, air_quality_raw):
+    """Combines raw provider responses into a standardized reading."""
     parsed_data = {}
 
     # Parse weather data
@@ -70,18 +190,23 @@ def fetch_and_parse_data(lat=35.6895, lon=139.6917):  # Default to Tokyo
     ):
         pollution = air_quality_raw["data"]["current"]["pollution"]
 
-        # PM2.5 (using aqius if mainus is p2)
+        # AirVisual reports AQI indexes, not concentrations. When PM2.5 is the
+        # main pollutant its concentration is recovered from the US index.
         if pollution.get("mainus") == "p2" and pollution.get("aqius") is not None:
-            parsed_data["pm25"] = pollution["aqius"]
+            parsed_data["pm25"] = round(
+                aqi_to_concentration("pm25", pollution["aqius"]), 1
+            )
         else:
             parsed_data["pm25"] = None  # Explicitly set to None if not found
 
         # CO (no direct equivalent in current raw data, keeping as None)
         parsed_data["co"] = None
 
-        # PM10 (using aqicn if maincn is p1)
+        # PM10 likewise, from the China index when PM10 is its main pollutant
         if pollution.get("maincn") == "p1" and pollution.get("aqicn") is not None:
-            parsed_data["pm10"] = pollution["aqicn"]
+            parsed_data["pm10"] = round(
+                aqi_to_concentration("pm10", pollution["aqicn"], scale="cn"), 1
+            )
         else:
             parsed_data["pm10"] = None  # Explicitly set to None if not found
     else:
@@ -92,4 +217,41 @@ def fetch_and_parse_data(lat=35.6895, lon=139.6917):  # Default to Tokyo
     # CO2 (still a placeholder as AirVisual API typically doesn't provide it)
     parsed_data.setdefault("co2", 450)  # Placeholder
 
+    for field in ("temperature", "humidity", "co", "pm25", "pm10"):
+        if parsed_data.get(field) is None:
+            increment("missing_fields_total", field=field)
+
     return parsed_data
+
+
+def fetch_many(locations, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """Fetches all providers for every location concurrently.
+
+    Yields ``((lat, lon), parsed_data)`` pairs in completion order, so a
+    cycle takes about as long as its slowest request rather than the sum
+    of all of them.
+    """
+    locations = list(locations)
+    providers = (get_weather_data, get_air_quality_data)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {}
+        for index, (lat, lon) in enumerate(locations):
+            for slot, provider in enumerate(providers):
+                futures[executor.submit(provider, lat, lon)] = (index, slot)
+
+        pending = [[None, None, len(providers)] for _ in locations]
+        for future in as_completed(futures):
+            index, slot = futures[future]
+            state = pending[index]
+            state[slot] = future.result()
+            state[2] -= 1
+            if state[2] == 0:
+                yield locations[index], parse_readings(state[0], state[1])
+
+
+@timed("fetch_and_parse_data")
+def fetch_and_parse_data(lat=35.6895, lon=139.6917):  # Default to Tokyo
+    """Fetches and parses data from all configured APIs."""
+    for _, parsed_data in fetch_many([(lat, lon)]):
+        return parsed_data
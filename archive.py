@@ -0,0 +1,131 @@
+import mmap
+import os
+import struct
+import zlib
+
+# File layout: a fixed header, a directory entry per column, then the column
+# data, each column starting on an 8-byte boundary so raw columns can be
+# viewed in place through mmap.
+MAGIC = b"EMSARCH1"
+# Header: magic, version, encoding, column count, rows, first timestamp, first id
+HEADER = struct.Struct("<8sBBHqqq")
+ENTRY = struct.Struct("<16sQQ")  # column name, offset, length in bytes
+VERSION = 1
+
+# "raw" keeps fixed-width arrays that are read without copying; "xor" stores
+# each float XORed with the one before it and zlib-compresses every column.
+ENCODINGS = {"raw": 0, "xor": 1}
+
+
+def _encode_column(name, values, encoding):
+    import numpy as np
+
+    if name == "timestamp":
+        # Rows are sorted by time, so gaps fit in 32 bits within a month
+        data = np.diff(values, prepend=values[:1]).astype("<u4")
+    elif name == "id":
+        data = np.diff(values, prepend=values[:1]).astype("<i8")
+    else:
+        data = np.ascontiguousarray(values, dtype="<f8")
+        if encoding == "xor":
+            bits = data.view("<u8")
+            data = bits ^ np.concatenate((np.zeros(1, dtype="<u8"), bits[:-1]))
+    if encoding == "xor":
+        return zlib.compress(data.tobytes(), 6)
+    return data.tobytes()
+
+
+def _decode_column(name, buffer, offset, length, rows, encoding, first):
+    import numpy as np
+
+    if name == "timestamp":
+        dtype = "<u4"
+    elif name == "id":
+        dtype = "<i8"
+    else:
+        dtype = "<u8" if encoding == "xor" else "<f8"
+
+    if encoding == "xor":
+        data = np.frombuffer(
+            zlib.decompress(buffer[offset : offset + length]), dtype=dtype
+        )
+    else:
+        # A view straight into the mapped file; nothing is copied
+        data = np.frombuffer(buffer, dtype=dtype, count=rows, offset=offset)
+
+    if name in ("timestamp", "id"):
+        return first + np.cumsum(data, dtype=np.int64)
+    if encoding == "xor":
+        return np.bitwise_xor.accumulate(data).view("<f8")
+    return data
+
+
+def write_month(path, columns, encoding):
+    """Writes one month of one site's readings as a columnar archive file.
+
+    ``columns`` maps ``timestamp`` (epoch seconds), ``id`` and each metric to
+    equal-length arrays sorted by (timestamp, id). The file is written next to
+    ``path`` and renamed into place, so readers never see a partial file.
+    """
+    names = list(columns)
+    rows = len(columns["timestamp"])
+    blobs = [_encode_column(name, columns[name], encoding) for name in names]
+
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        ENCODINGS[encoding],
+        len(names),
+        rows,
+        int(columns["timestamp"][0]) if rows else 0,
+        int(columns["id"][0]) if rows else 0,
+    )
+    offset = HEADER.size + ENTRY.size * len(names)
+    entries, padded = [], []
+    for name, blob in zip(names, blobs):
+        offset += -offset % 8
+        entries.append(ENTRY.pack(name.encode(), offset, len(blob)))
+        padded.append(blob)
+        offset += len(blob)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(b"".join(entries))
+        for blob in padded:
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_month(path, names=None):
+    """Reads an archive file's columns (all, or those in ``names``).
+
+    Returns a dict of NumPy arrays like the one write_month was given. Raw
+    float columns are zero-copy views of the memory-mapped file.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, encoding, count, rows, first_ts, first_id = HEADER.unpack_from(
+        buffer
+    )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a readings archive")
+    encoding = "xor" if encoding == ENCODINGS["xor"] else "raw"
+
+    columns = {}
+    for index in range(count):
+        raw_name, offset, length = ENTRY.unpack_from(
+            buffer, HEADER.size + ENTRY.size * index
+        )
+        name = raw_name.rstrip(b"\0").decode()
+        if names is not None and name not in names and name != "timestamp":
+            continue
+        first = first_ts if name == "timestamp" else first_id
+        columns[name] = _decode_column(
+            name, buffer, offset, length, rows, encoding, first
+        )
+    return columns
@@ -0,0 +1,88 @@
+"""Compares two benchmark results written by run.py.
+
+    python3 bench/compare.py baseline.json results.json --threshold 10
+
+Prints every measurement both runs share with its relative change, and
+exits with status 1 if any got worse by more than --threshold percent.
+Rates (``*_per_sec``) are better when higher; times and memory when lower.
+"""
+
+import argparse
+import json
+import sys
+
+# Counts and settings rather than measurements, and the synthetic database
+# setup, which is only timed when the database is first built; never a regression
+IGNORED = {"readings", "rows", "incomplete_readings", "mock", "setup_seconds"}
+
+
+def _leaves(result, path=()):
+    """Yields ``(path, value)`` for every numeric measurement in a result."""
+    if isinstance(result, dict):
+        for key, value in result.items():
+            if key not in IGNORED:
+                yield from _leaves(value, path + (key,))
+    elif isinstance(result, list):
+        for item in result:
+            # History runs are told apart by their size, not their position
+            key = f"{item['rows']:,} rows" if isinstance(item, dict) else "?"
+            yield from _leaves(item, path + (key,))
+    elif isinstance(result, (int, float)) and not isinstance(result, bool):
+        yield path, result
+
+
+def _higher_is_better(path):
+    return path[-1].endswith("_per_sec")
+
+
+def compare(old, new, threshold):
+    """Returns ``(rows, regressions)`` for the measurements both runs have."""
+    before = dict(_leaves({k: v for k, v in old.items() if k != "meta"}))
+    after = dict(_leaves({k: v for k, v in new.items() if k != "meta"}))
+    rows, regressions = [], []
+    for path, old_value in before.items():
+        if path not in after:
+            continue
+        new_value = after[path]
+        change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+        worse = -change if _higher_is_better(path) else change
+        name = ".".join(path)
+        rows.append((name, old_value, new_value, change, worse > threshold))
+        if worse > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="allowed slowdown in percent"
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.results) as f:
+        new = json.load(f)
+    for label, result in (("baseline", old), ("results", new)):
+        meta = result.get("meta", {})
+        commit = (meta.get("commit") or "?")[:10]
+        print(f"{label}: {commit} {meta.get('created_at', '')}")
+
+    rows, regressions = compare(old, new, args.threshold)
+    width = max((len(row[0]) for row in rows), default=0)
+    for name, old_value, new_value, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(
+            f"{name:<{width}}  {old_value:>12.4g}  {new_value:>12.4g}"
+            f"  {change:>+7.1f}%{flag}"
+        )
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:g}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
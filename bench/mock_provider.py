@@ -0,0 +1,193 @@
+"""Local stand-in for the OpenWeatherMap and AirVisual endpoints.
+
+Serves the response shapes parse_readings reads, with configurable latency,
+error rate and payload variance, so the fetch path can be benchmarked
+without network access or API quotas:
+
+    python3 bench/mock_provider.py --port 8765 --latency 0.05 --error-rate 0.02
+
+then point OPENWEATHER_BASE_URL and AIRVISUAL_BASE_URL at
+http://127.0.0.1:8765.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    """HTTP server answering both providers' endpoints.
+
+    ``latency`` is the mean delay per response in seconds, varied by up to
+    ``jitter`` of itself either way. ``error_rate`` is the fraction of
+    requests answered with a 500 (or, for a tenth of those, a 429).
+    ``variance`` is the fraction of responses that drop an optional field,
+    and also scales how far values stray from their typical level.
+    ``padding`` adds up to that many bytes of filler to each body. Responses
+    are drawn from a generator seeded with ``seed``.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency=0.0,
+        jitter=0.5,
+        error_rate=0.0,
+        variance=0.1,
+        padding=0,
+        seed=0,
+    ):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.variance = variance
+        self.padding = padding
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self):
+        """Returns a generator for one response, seeded from the server's."""
+        with self._lock:
+            self.requests += 1
+            return random.Random(self._random.getrandbits(64))
+
+    def weather(self, rng):
+        spread = 1 + 4 * self.variance
+        main = {
+            "temp": round(rng.gauss(22, 3 * spread), 2),
+            "feels_like": round(rng.gauss(22, 3 * spread), 2),
+            "pressure": 1013,
+            "humidity": max(0, min(100, round(rng.gauss(55, 10 * spread)))),
+        }
+        if rng.random() < self.variance:
+            del main["humidity"]
+        return {
+            "coord": {"lon": 139.69, "lat": 35.69},
+            "weather": [{"id": 800, "main": "Clear", "description": "clear sky"}],
+            "main": main,
+            "wind": {"speed": 3.1, "deg": 200},
+            "name": "Mock City",
+            "cod": 200,
+        }
+
+    def air_quality(self, rng):
+        spread = 1 + 4 * self.variance
+        pollution = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "aqius": max(0, round(rng.gauss(45, 15 * spread))),
+            "mainus": "p2" if rng.random() >= self.variance else "o3",
+            "aqicn": max(0, round(rng.gauss(30, 10 * spread))),
+            "maincn": "p1" if rng.random() < 0.5 else "p2",
+        }
+        return {
+            "status": "success",
+            "data": {
+                "city": "Mock City",
+                "country": "Mockland",
+                "current": {
+                    "pollution": pollution,
+                    "weather": {"tp": 22, "hu": 55},
+                },
+            },
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the real APIs allow
+    # Headers and body go out as separate writes; with Nagle on, each reply
+    # on a reused connection would wait out the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        rng = server.draw()
+        if server.latency:
+            spread = server.latency * server.jitter
+            time.sleep(max(0.0, server.latency + rng.uniform(-spread, spread)))
+
+        path = urlparse(self.path).path
+        if path == "/data/2.5/weather":
+            body = server.weather(rng)
+        elif path == "/v2/nearest_city":
+            body = server.air_quality(rng)
+        else:
+            self._send(404, {"message": "not found"})
+            return
+        if not parse_qs(urlparse(self.path).query).get("lat"):
+            self._send(400, {"message": "lat and lon are required"})
+            return
+        if rng.random() < server.error_rate:
+            if rng.random() < 0.1:
+                self._send(429, {"message": "too many requests"}, {"Retry-After": "1"})
+            else:
+                self._send(500, {"message": "internal error"})
+            return
+        if server.padding:
+            body["padding"] = "x" * rng.randrange(server.padding + 1)
+        self._send(200, body)
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_provider(port=0, **options):
+    """Starts a MockProviderServer on 127.0.0.1 in a daemon thread."""
+    server = MockProviderServer(("127.0.0.1", port), **options)
+    threading.Thread(
+        target=server.serve_forever, name="mock-provider", daemon=True
+    ).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--variance", type=float, default=0.1)
+    parser.add_argument("--padding", type=int, default=0, help="max filler bytes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = MockProviderServer(
+        ("127.0.0.1", args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        variance=args.variance,
+        padding=args.padding,
+        seed=args.seed,
+    )
+    print(f"Mock providers listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""End-to-end benchmarks for the fetch pipeline and historical range scans.
+
+    python3 bench/run.py --output results.json
+    python3 bench/compare.py baseline.json results.json
+
+The pipeline benchmark drives fetch_and_parse_data -> save_data ->
+check_thresholds -> get_tips against a local mock provider server (see
+mock_provider.py) running in its own process. The history benchmark runs
+get_historical_data range scans on synthetic databases, generated once per
+size under --data-dir and reused afterwards. Every scenario runs in a fresh
+child process, so its peak RSS is its own; each database is built in a child
+of its own first. Results are written as JSON.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+FORMAT_VERSION = 1
+
+# First synthetic reading; one reading per minute follows
+SYNTHETIC_START = 1577836800  # 2020-01-01 00:00:00 UTC
+
+# Scan widths in minutes (= rows); ranges wider than the database are skipped
+SCAN_RANGES = {"hour": 60, "day": 1440, "week": 10080, "month": 43200, "year": 525600}
+
+
+def _percentiles(samples):
+    """Nearest-rank p50/p90/p95/p99 and max of durations, in milliseconds."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def rank(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "p50": rank(0.50),
+        "p90": rank(0.90),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": ordered[-1] * 1000,
+    }
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _serve_mock(conn, options):
+    from mock_provider import MockProviderServer
+
+    server = MockProviderServer(("127.0.0.1", 0), **options)
+    conn.send(server.url)
+    server.serve_forever()
+
+
+def bench_pipeline(args):
+    """Times each reading through fetch, save, threshold check and tips."""
+    parent, child = multiprocessing.Pipe()
+    options = {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "variance": args.variance,
+        "seed": args.seed,
+    }
+    server = multiprocessing.Process(target=_serve_mock, args=(child, options))
+    server.daemon = True
+    server.start()
+    url = parent.recv()
+
+    # Read by api_handler at import time
+    os.environ.update(
+        {
+            "OPENWEATHER_API_KEY": "bench",
+            "AIRVISUAL_API_KEY": "bench",
+            "OPENWEATHER_BASE_URL": url,
+            "AIRVISUAL_BASE_URL": url,
+            "OPENWEATHER_CALLS_PER_MINUTE": "1e9",
+            "OPENWEATHER_CALLS_PER_DAY": "1e12",
+            "AIRVISUAL_CALLS_PER_MINUTE": "1e9",
+            "AIRVISUAL_CALLS_PER_DAY": "1e12",
+        }
+    )
+    import db_handler
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_handler.DB_NAME = os.path.join(directory, "bench.db")
+        db_handler.initialize_db()
+
+        from alerter import check_thresholds
+        from api_handler import fetch_and_parse_data
+        from tips import get_tips
+
+        stages = {"fetch": [], "save": [], "check": [], "tips": []}
+        totals = []
+        incomplete = 0
+        rng = random.Random(args.seed)
+        # Provider output (retries, errors) would drown the benchmark's own
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            for _ in range(args.readings):
+                # A new grid cell each time, so the response cache never answers
+                lat, lon = rng.uniform(-80, 80), rng.uniform(-180, 180)
+                t0 = time.perf_counter()
+                data = fetch_and_parse_data(lat, lon)
+                t1 = time.perf_counter()
+                data["site_id"] = db_handler.DEFAULT_SITE_ID
+                db_handler.save_data(data)
+                t2 = time.perf_counter()
+                alerts = check_thresholds(data)
+                t3 = time.perf_counter()
+                get_tips(alerts)
+                t4 = time.perf_counter()
+
+                stages["fetch"].append(t1 - t0)
+                stages["save"].append(t2 - t1)
+                stages["check"].append(t3 - t2)
+                stages["tips"].append(t4 - t3)
+                totals.append(t4 - t0)
+                if data.get("temperature") is None or data.get("pm25") is None:
+                    incomplete += 1
+            elapsed = time.perf_counter() - started
+        db_handler.close_connection()
+
+    server.terminate()
+    return {
+        "readings": args.readings,
+        "seconds": elapsed,
+        "readings_per_sec": args.readings / elapsed,
+        "incomplete_readings": incomplete,
+        "latency_ms": _percentiles(totals),
+        "stages_ms": {name: _percentiles(samples) for name, samples in stages.items()},
+        "mock": options,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _synthetic_rows(rows, seed, chunk=100_000):
+    """Yields chunks of one-per-minute readings for bulk_insert_readings."""
+    from recent import format_timestamp
+
+    rng = random.Random(seed)
+    for start in range(0, rows, chunk):
+        batch = []
+        for index in range(start, min(start + chunk, rows)):
+            batch.append(
+                (
+                    1,
+                    format_timestamp(SYNTHETIC_START + 60 * index),
+                    round(rng.gauss(22, 5), 2),
+                    round(rng.uniform(20, 90), 1),
+                    round(rng.gauss(450, 40)),
+                    None,
+                    round(rng.uniform(2, 60), 1),
+                    round(rng.uniform(5, 120), 1),
+                )
+            )
+        yield batch
+
+
+def synthetic_database(rows, data_dir, seed):
+    """Returns the path of a database with ``rows`` readings, creating it once."""
+    import db_handler
+
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"history_{rows}_{seed}.db")
+    db_handler.DB_NAME = path
+    db_handler.initialize_db()
+    count = db_handler.get_connection().execute(
+        "SELECT count(*) FROM readings"
+    ).fetchone()[0]
+    if count != rows:
+        db_handler.close_connection()
+        for suffix in ("", "-wal", "-shm"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path + suffix)
+        db_handler.initialize_db()
+        # Scans read raw readings only, so rollups are not built
+        db_handler.bulk_insert_readings(_synthetic_rows(rows, seed))
+    return path
+
+
+def bench_history(args):
+    """Times get_historical_data over ranges of several widths."""
+    import db_handler
+    from recent import format_timestamp
+
+    started = time.perf_counter()
+    synthetic_database(args.rows, args.data_dir, args.seed)
+    setup = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+    scans = {}
+    for name, width in SCAN_RANGES.items():
+        if width > args.rows:
+            continue
+        durations, returned = [], 0
+        for _ in range(args.scans):
+            first = rng.randrange(args.rows - width + 1)
+            start = format_timestamp(SYNTHETIC_START + 60 * first)
+            end = format_timestamp(SYNTHETIC_START + 60 * (first + width - 1))
+            t0 = time.perf_counter()
+            returned = len(db_handler.get_historical_data(start, end))
+            durations.append(time.perf_counter() - t0)
+        scans[name] = {
+            "rows": returned,
+            "latency_ms": _percentiles(durations),
+            "rows_per_sec": returned * len(durations) / sum(durations),
+        }
+    db_handler.close_connection()
+    return {
+        "rows": args.rows,
+        "setup_seconds": setup,
+        "scans": scans,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _metadata(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "format_version": FORMAT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": {
+            "readings": args.readings,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "variance": args.variance,
+            "rows": args.rows,
+            "scans": args.scans,
+            "seed": args.seed,
+        },
+    }
+
+
+def _run_child(scenario, args, rows=None):
+    """Runs one scenario in a fresh interpreter and returns its result."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    command = [sys.executable, os.path.abspath(__file__)]
+    for option in ("readings", "latency", "error_rate", "variance", "scans", "seed"):
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    command += ["--data-dir", args.data_dir, "--rows", str(rows or 0)]
+    command += ["--scenario", scenario, "--child-output", output]
+    try:
+        subprocess.run(command, check=True)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="-", help="JSON file (default: stdout)")
+    parser.add_argument(
+        "--only", choices=("pipeline", "history"), help="run one benchmark"
+    )
+    parser.add_argument("--readings", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0, help="mock seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--variance", type=float, default=0.1)
+    parser.add_argument(
+        "--rows",
+        default="10000,100000,1000000",
+        help="comma-separated database sizes (100000000 takes a while to build)",
+    )
+    parser.add_argument("--scans", type=int, default=20, help="repeats per range")
+    parser.add_argument("--data-dir", default=os.path.join(ROOT, "bench", "data"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        if args.scenario == "pipeline":
+            result = bench_pipeline(args)
+        elif args.scenario == "build":
+            result = synthetic_database(int(args.rows), args.data_dir, args.seed)
+        else:
+            args.rows = int(args.rows)
+            result = bench_history(args)
+        with open(args.child_output, "w") as f:
+            json.dump(result, f)
+        return
+
+    sizes = [int(size) for size in args.rows.split(",")]
+    results = {"meta": _metadata(args)}
+    results["meta"]["options"]["rows"] = sizes
+    if args.only in (None, "pipeline"):
+        print(f"Pipeline: {args.readings} readings...", file=sys.stderr)
+        results["pipeline"] = _run_child("pipeline", args)
+    if args.only in (None, "history"):
+        results["history"] = []
+        for rows in sizes:
+            print(f"History: {rows:,} rows...", file=sys.stderr)
+            # Built beforehand, so the scan child's peak RSS leaves out the build
+            _run_child("build", args, rows)
+            results["history"].append(_run_child("history", args, rows))
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
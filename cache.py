@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """TTL cache for provider responses keyed by a lat/lon grid cell.
+
+    Entries live in an in-memory LRU and, when ``disk_path`` is set, in a
+    small SQLite file so they survive restarts. Expiry uses wall-clock time
+    for both tiers.
+    """
+
+    def __init__(self, ttls, grid, max_entries, disk_path=None):
+        self.ttls = ttls
+        self.grid = grid
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.hits = {}
+        self.misses = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+
+    def _key(self, provider, lat, lon):
+        return (provider, round(lat / self.grid), round(lon / self.grid))
+
+    def _get_disk(self):
+        if self._disk is None:
+            self._disk = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._disk.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    expires_at REAL,
+                    body TEXT
+                )
+            """
+            )
+        return self._disk
+
+    def get(self, provider, lat, lon):
+        """Returns the cached response for the cell, or None on a miss."""
+        key = self._key(provider, lat, lon)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits[provider] = self.hits.get(provider, 0) + 1
+                return entry[1]
+
+            value = None
+            if self.disk_path:
+                value = self._get_from_disk(key, now)
+            if value is None:
+                self._entries.pop(key, None)
+                self.misses[provider] = self.misses.get(provider, 0) + 1
+                return None
+
+            self.hits[provider] = self.hits.get(provider, 0) + 1
+            return value
+
+    def _get_from_disk(self, key, now):
+        disk = self._get_disk()
+        row = disk.execute(
+            "SELECT expires_at, body FROM responses WHERE key = ?", (repr(key),)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] <= now:
+            with disk:
+                disk.execute("DELETE FROM responses WHERE key = ?", (repr(key),))
+            return None
+        value = json.loads(row[1])
+        self._remember(key, row[0], value)
+        return value
+
+    def _remember(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set(self, provider, lat, lon, value):
+        """Stores a response for the cell under the provider's TTL."""
+        key = self._key(provider, lat, lon)
+        expires_at = time.time() + self.ttls.get(provider, 0)
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self.disk_path:
+                with self._get_disk() as disk:
+                    disk.execute(
+                        "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                        (repr(key), expires_at, json.dumps(value)),
+                    )
+
+    def clear(self):
+        """Drops every cached response from both tiers."""
+        with self._lock:
+            self._entries.clear()
+            if self.disk_path:
+                with self._get_disk() as disk:
+                    disk.execute("DELETE FROM responses")
+
+    def stats(self):
+        """Returns hit/miss counters per provider."""
+        with self._lock:
+            providers = set(self.hits) | set(self.misses)
+            return {
+                provider: {
+                    "hits": self.hits.get(provider, 0),
+                    "misses": self.misses.get(provider, 0),
+                }
+                for provider in sorted(providers)
+            }
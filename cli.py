@@ -6,21 +6,49 @@ from rich.text import Text
 from rich.table import Table
 from rich.markdown import Markdown
 
-from alerter import check_thresholds
+from alert_engine import AlertEngine
+from alerter import check_thresholds, evaluator, format_alert
+from analytics import summarize
+from anomaly import AnomalyDetector, format_anomaly
 from api_handler import fetch_and_parse_data
-from config import DEFAULT_THRESHOLDS
+from config import (
+    ANALYTICS_HALFLIFE,
+    ANALYTICS_WINDOW,
+    DEFAULT_THRESHOLDS,
+    HISTORY_MAX_POINTS,
+    HISTORY_PAGE_SIZE,
+    METRICS_ENABLED,
+)
 from db_handler import (
-    get_historical_data,
+    DEFAULT_SITE_ID,
+    METRICS,
+    add_site,
+    get_historical_columns,
     get_latest_readings,
+    get_readings_page,
+    get_rollup_series,
+    get_site,
+    get_sites,
     get_thresholds,
     save_data,
     set_threshold,
+    summarize_readings,
 )
+from metrics import counters, stage_summary
 from tips import get_tips
 
 
 console = Console()
 
+# Remembers which alerts are already active so repeated fetches don't repeat them
+alert_engine = AlertEngine()
+
+# Learns each site's normal readings to flag spikes and shifts within limits
+anomaly_detector = AnomalyDetector()
+
+# Site the menu actions apply to; changed with "Select Site"
+current_site_id = DEFAULT_SITE_ID
+
 
 def clear_screen():
     """Clears the terminal screen."""
@@ -37,7 +65,11 @@ def print_header():
 
 def print_menu():
     """Prints the main menu options with rich styling."""
+    site = get_site(current_site_id)
     menu = Text()
+    menu.append(
+        f"\nSite: {site.name if site else current_site_id}\n", style="bold cyan"
+    )
     menu.append("\n[1] ", style="bold green")
     menu.append("Fetch & Log Current Data\n")
     menu.append("[2] ", style="bold green")
@@ -45,10 +77,16 @@ def print_menu():
     menu.append("[3] ", style="bold green")
     menu.append("Query Historical Data\n")
     menu.append("[4] ", style="bold green")
-    menu.append("Set Safety Thresholds\n")
+    menu.append("Analyze Historical Data\n")
     menu.append("[5] ", style="bold green")
+    menu.append("Set Safety Thresholds\n")
+    menu.append("[6] ", style="bold green")
     menu.append("View Health & Safety Tips\n")
-    menu.append("[6] ", style="bold red")
+    menu.append("[7] ", style="bold green")
+    menu.append("Select Site\n")
+    menu.append("[8] ", style="bold green")
+    menu.append("Pipeline Stats\n")
+    menu.append("[9] ", style="bold red")
     menu.append("Exit")
 
     console.print(menu, justify="left")
@@ -61,20 +99,48 @@ def handle_fetch_data():
     console.print("\n[bold blue]Fetching latest environmental data...[/bold blue]")
 
     try:
-        data = fetch_and_parse_data()
+        site = get_site(current_site_id)
+        data = fetch_and_parse_data(site.lat, site.lon)
+        data["site_id"] = site.id
         save_data(data)
         console.print(
             "[bold green]Data successfully logged to the database.[/bold green]"
         )
 
-        alerts = check_thresholds(data)
-        if alerts:
-            for alert in alerts:
-                console.print(f"[bold red]{alert}[/bold red]")
-        else:
+        events = alert_engine.process(data, site=site.id)
+        for event in events:
+            if event.kind == "raised":
+                console.print(f"[bold red]{format_alert(event)}[/bold red]")
+            else:
+                console.print(
+                    f"[bold green]CLEARED: {event.metric.capitalize()} is back "
+                    f"within limits: {event.value:.2f}[/bold green]"
+                )
+
+        active = alert_engine.active_alerts(site.id)
+        for alert in active:
+            if alert not in events:
+                console.print(f"[dim]Still active: {format_alert(alert)}[/dim]")
+
+        # Breaches held back until they last ALERT_MIN_DURATION
+        active_metrics = {alert.metric for alert in active}
+        pending = [
+            alert
+            for alert in check_thresholds(data, site.id)
+            if alert.metric not in active_metrics
+        ]
+        for alert in pending:
+            console.print(
+                f"[yellow]Waiting to confirm: {format_alert(alert)}[/yellow]"
+            )
+        if not active and not pending:
             console.print(
                 "[bold green]All readings are within safe limits.[/bold green]"
             )
+
+        for anomaly in anomaly_detector.process(data, site.id):
+            console.print(f"[bold yellow]{format_anomaly(anomaly)}[/bold yellow]")
+        anomaly_detector.flush(force=True)
     except Exception as e:
         console.print(f"[bold red]An error occurred: {e}[/bold red]")
 
@@ -83,7 +149,7 @@ def handle_show_latest():
     """Handles displaying the most recent readings."""
     clear_screen()
     console.print("\n[bold blue]Fetching latest readings...[/bold blue]")
-    readings = get_latest_readings()
+    readings = get_latest_readings(current_site_id)
     if not readings:
         console.print("[bold yellow]No data available. Fetch data first.[/bold yellow]")
         return
@@ -119,7 +185,7 @@ def handle_show_latest():
 
 
 def handle_query_historical():
-    """Handles querying and displaying historical data."""
+    """Handles querying and paging through historical data."""
     clear_screen()
     console.print("\n[bold blue]Query historical data:[/bold blue]")
 
@@ -129,36 +195,197 @@ def handle_query_historical():
         start_date = datetime.strptime(start_str, "%Y-%m-%d")
         end_date = datetime.strptime(end_str, "%Y-%m-%d")
 
-        data = get_historical_data(start_date, end_date)
-        if not data:
+        summary = summarize_readings(start_date, end_date, site_id=current_site_id)
+        if not summary["count"]:
             console.print(
                 "[bold yellow]No data found for the specified range.[/bold yellow]"
             )
             return
+        page_history(start_date, end_date, summary)
 
-        history_table = Table(title="Historical Environmental Data", style="cyan")
-        # Dynamically add columns based on the keys of the first data entry
-        for key in data[0].keys():
-            history_table.add_column(key.replace("_", " ").title(), style="bold")
+    except ValueError:
+        console.print(
+            "[bold red]Invalid date format. Please use YYYY-MM-DD.[/bold red]"
+        )
+    except Exception as e:
+        console.print(f"[bold red]An error occurred: {e}[/bold red]")
 
-        for row_data in data:
-            history_table.add_row(*[str(value) for value in row_data.values()])
 
+def show_history_summary(summary):
+    """Displays the count and per-metric min/max/mean for a range."""
+    summary_table = Table(
+        title=f"Summary ({summary['count']} readings)", style="magenta"
+    )
+    summary_table.add_column("Metric", style="bold")
+    summary_table.add_column("Min", style="green")
+    summary_table.add_column("Max", style="red")
+    summary_table.add_column("Mean")
+    for metric in METRICS:
+        values = [
+            "N/A" if value is None else f"{value:.2f}" for value in summary[metric]
+        ]
+        summary_table.add_row(metric.capitalize(), *values)
+    console.print(summary_table)
+
+
+def page_history(start_date, end_date, summary):
+    """Pages through a range's readings, fetching and formatting one page at a time."""
+    total = summary["count"]
+    page = get_readings_page(start_date, end_date, site_id=current_site_id)
+    offset = 0
+
+    while True:
+        clear_screen()
+        show_history_summary(summary)
+
+        history_table = Table(
+            title=f"Historical Environmental Data "
+            f"(rows {offset + 1}–{offset + len(page)} of {total})",
+            style="cyan",
+        )
+        for key in page[0].keys():
+            history_table.add_column(key.replace("_", " ").title(), style="bold")
+        for row_data in page:
+            history_table.add_row(*[str(value) for value in row_data.values()])
         console.print(history_table)
 
+        has_next = offset + len(page) < total
+        choices = ["[n]ext"] if has_next else []
+        if offset:
+            choices.append("[p]revious")
+        choices += ["[r]ollups", "[q]uit"]
+        choice = console.input(f"[bold]{', '.join(choices)}: [/bold]").lower()
+
+        if choice == "n" and has_next:
+            last = page[-1]
+            page = get_readings_page(
+                start_date,
+                end_date,
+                after=(last["timestamp"], last["id"]),
+                site_id=current_site_id,
+            )
+            offset += HISTORY_PAGE_SIZE
+        elif choice == "p" and offset:
+            first = page[0]
+            page = get_readings_page(
+                start_date,
+                end_date,
+                before=(first["timestamp"], first["id"]),
+                site_id=current_site_id,
+            )
+            offset = max(0, offset - HISTORY_PAGE_SIZE)
+        elif choice == "r":
+            clear_screen()
+            show_rollups(start_date, end_date)
+            return
+        elif choice == "q":
+            return
+        if not page:
+            return
+
+
+def show_rollups(start_date, end_date):
+    """Displays aggregated readings for ranges too large to list row by row."""
+    resolution, rollups = get_rollup_series(
+        start_date, end_date, HISTORY_MAX_POINTS, site_id=current_site_id
+    )
+
+    history_table = Table(
+        title=f"Historical Environmental Data (per {resolution}, mean (min–max))",
+        style="cyan",
+    )
+    metrics = sorted({rollup.metric for rollup in rollups})
+    history_table.add_column("Bucket", style="bold")
+    for metric in metrics:
+        history_table.add_column(metric.replace("_", " ").title(), style="bold")
+
+    rows = {}
+    for rollup in rollups:
+        rows.setdefault(rollup.bucket, {})[rollup.metric] = (
+            f"{rollup.mean:.2f} ({rollup.min:.2f}–{rollup.max:.2f})"
+        )
+    for bucket, values in rows.items():
+        history_table.add_row(
+            bucket, *[values.get(metric, "N/A") for metric in metrics]
+        )
+
+    console.print(history_table)
+
+
+def handle_analyze_historical():
+    """Handles showing rolling statistics and AQI for a date range."""
+    clear_screen()
+    console.print("\n[bold blue]Analyze historical data:[/bold blue]")
+
+    try:
+        start_str = console.input("[bold]Enter start date (YYYY-MM-DD): [/bold]")
+        end_str = console.input("[bold]Enter end date (YYYY-MM-DD): [/bold]")
+        start_date = datetime.strptime(start_str, "%Y-%m-%d")
+        end_date = datetime.strptime(end_str, "%Y-%m-%d")
+        window_str = console.input(
+            f"[bold]Rolling window in hours "
+            f"(default {ANALYTICS_WINDOW / 3600:g}): [/bold]"
+        )
+        window = float(window_str) * 3600 if window_str else ANALYTICS_WINDOW
+
+        columns = get_historical_columns(start_date, end_date, site_id=current_site_id)
+        if not len(columns["timestamp"]):
+            console.print(
+                "[bold yellow]No data found for the specified range.[/bold yellow]"
+            )
+            return
+        summaries = summarize(columns, window, ANALYTICS_HALFLIFE)
     except ValueError:
         console.print(
-            "[bold red]Invalid date format. Please use YYYY-MM-DD.[/bold red]"
+            "[bold red]Invalid input. Use YYYY-MM-DD dates and a number of "
+            "hours.[/bold red]"
         )
+        return
     except Exception as e:
         console.print(f"[bold red]An error occurred: {e}[/bold red]")
+        return
+
+    def fmt(value):
+        return "N/A" if value is None or value != value else f"{value:.2f}"
+
+    analysis_table = Table(
+        title=f"Analysis ({len(columns['timestamp'])} readings, "
+        f"{window / 3600:g}h window)",
+        style="cyan",
+    )
+    analysis_table.add_column("Statistic", style="bold")
+    for metric in summaries:
+        analysis_table.add_column(metric.capitalize(), style="green")
+
+    rows = {"Min": [], "Mean": [], "Max": []}
+    for summary in summaries.values():
+        rows["Min"].append(fmt(summary.min))
+        rows["Mean"].append(fmt(summary.mean))
+        rows["Max"].append(fmt(summary.max))
+        for q, value in summary.percentiles.items():
+            rows.setdefault(f"P{q}", []).append(fmt(value))
+        for field in ("mean", "min", "max"):
+            value = getattr(summary.rolling, field) if summary.rolling else None
+            rows.setdefault(f"Rolling {field}", []).append(fmt(value))
+        rows.setdefault("EWMA", []).append(fmt(summary.ewma))
+        rows.setdefault("AQI (US)", []).append(
+            str(summary.aqi) if summary.aqi is not None else "N/A"
+        )
+    for label, values in rows.items():
+        analysis_table.add_row(label, *values)
+
+    console.print(analysis_table)
+    console.print(
+        "[dim]Rolling values and EWMA are as of the last reading; AQI is "
+        "from the rolling mean.[/dim]"
+    )
 
 
 def handle_set_thresholds():
     """Handles setting new safety thresholds."""
     clear_screen()
     console.print("\n[bold blue]Current thresholds:[/bold blue]")
-    thresholds = get_thresholds()
+    thresholds = get_thresholds(current_site_id)
 
     threshold_table = Table(title="Current Safety Thresholds", style="magenta")
     threshold_table.add_column("Metric", style="bold")
@@ -186,9 +413,17 @@ def handle_set_thresholds():
 
         min_val = float(min_val_str) if min_val_str else None
         max_val = float(max_val_str) if max_val_str else None
-
-        set_threshold(metric, min_val, max_val)
-        console.print(f"[bold green]Threshold for {metric} updated.[/bold green]")
+        site_only = console.input(
+            "[bold]Apply to the current site only? (y/N): [/bold]"
+        ).lower()
+
+        site_id = current_site_id if site_only == "y" else None
+        set_threshold(metric, min_val, max_val, site_id=site_id)
+        evaluator.invalidate()  # applies from the next reading, not the next check
+        scope = "this site" if site_id else "all sites"
+        console.print(
+            f"[bold green]Threshold for {metric} updated for {scope}.[/bold green]"
+        )
     except ValueError:
         console.print("[bold red]Invalid input. Please enter a number.[/bold red]")
     except Exception as e:
@@ -200,7 +435,7 @@ def handle_view_tips():
     clear_screen()
     console.print("\n[bold blue]Fetching health and safety tips...[/bold blue]")
 
-    latest_data = get_latest_readings()
+    latest_data = get_latest_readings(current_site_id)
     if not latest_data:
         console.print(
             "[bold yellow]No data available to generate tips. Fetch data first.[/bold yellow]"
@@ -216,3 +451,86 @@ def handle_view_tips():
         console.print(
             "[italic green]No specific tips for current conditions. All good![/italic green]"
         )
+
+
+def handle_select_site():
+    """Handles choosing the site that other menu actions apply to."""
+    global current_site_id
+    clear_screen()
+
+    site_table = Table(title="Monitored Sites", style="cyan")
+    site_table.add_column("ID", style="bold")
+    site_table.add_column("Name")
+    site_table.add_column("Latitude", style="dim")
+    site_table.add_column("Longitude", style="dim")
+    for site in get_sites():
+        marker = " *" if site.id == current_site_id else ""
+        site_table.add_row(
+            f"{site.id}{marker}", site.name, str(site.lat), str(site.lon)
+        )
+    console.print(site_table)
+
+    choice = console.input(
+        "[bold]Enter a site ID, 'new' to add a site, or leave blank to keep: [/bold]"
+    ).strip()
+    if not choice:
+        return
+
+    try:
+        if choice.lower() == "new":
+            name = console.input("[bold]Site name: [/bold]").strip()
+            lat = float(console.input("[bold]Latitude: [/bold]"))
+            lon = float(console.input("[bold]Longitude: [/bold]"))
+            if not name:
+                console.print("[bold yellow]A site needs a name.[/bold yellow]")
+                return
+            current_site_id = add_site(name, lat, lon)
+        elif get_site(int(choice)):
+            current_site_id = int(choice)
+        else:
+            console.print(f"[bold yellow]Unknown site: {choice}[/bold yellow]")
+            return
+        console.print(
+            f"[bold green]Now working with {get_site(current_site_id).name}.[/bold green]"
+        )
+    except ValueError:
+        console.print("[bold red]Invalid input. Please enter a number.[/bold red]")
+
+
+def handle_pipeline_stats():
+    """Handles showing how long each pipeline stage takes."""
+    clear_screen()
+    if not METRICS_ENABLED:
+        console.print(
+            "[bold yellow]Instrumentation is off (METRICS_ENABLED in "
+            "config.py).[/bold yellow]"
+        )
+        return
+    stages = stage_summary()
+    if not stages:
+        console.print("[bold yellow]No timings yet. Fetch data first.[/bold yellow]")
+        return
+
+    def ms(seconds):
+        return "N/A" if seconds is None else f"{seconds * 1000:.2f}"
+
+    stage_table = Table(title="Pipeline Stage Timings (ms)", style="cyan")
+    stage_table.add_column("Stage", style="bold")
+    stage_table.add_column("Calls")
+    stage_table.add_column("Errors", style="red")
+    for label in ("p50", "p95", "p99"):
+        stage_table.add_column(label, style="green")
+    for stage, (calls, errors, percentiles) in stages.items():
+        timings = [ms(value) for value in percentiles.values()]
+        stage_table.add_row(stage, str(calls), str(errors), *timings)
+    console.print(stage_table)
+
+    counter_table = Table(title="Counters", style="magenta")
+    counter_table.add_column("Counter", style="bold")
+    counter_table.add_column("Label")
+    counter_table.add_column("Count")
+    for (name, key, value), count in sorted(counters().items()):
+        if name != "errors_total":
+            counter_table.add_row(name, f"{key}={value}", str(count))
+    if counter_table.row_count:
+        console.print(counter_table)
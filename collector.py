@@ -0,0 +1,209 @@
+import asyncio
+import random
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from alert_engine import AlertEngine
+from alerter import ThresholdEvaluator, format_alert
+from anomaly import AnomalyDetector, format_anomaly
+from api_handler import fetch_and_parse_data, provider_quotas
+from config import MAX_INFLIGHT_FETCHES, MONITORED_LOCATIONS, POLL_INTERVAL, POLL_JITTER
+from db_handler import add_site, close_connection, save_many
+from ratelimit import PriorityScheduler
+
+_STOP = object()
+
+
+def log(message):
+    """Prints a timestamped line for the collector's unattended output."""
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {message}", flush=True)
+
+
+class Collector:
+    """Polls locations on a schedule and pipes readings through save and alert stages.
+
+    Each location runs its own polling loop, offset by a random start and
+    jittered waits so requests don't all fire together. At most
+    ``max_inflight`` fetches run at once, and a PriorityScheduler paces them
+    to the providers' call quotas, serving locations with active alerts
+    first when there is a backlog. Fetched readings flow through a
+    bounded queue to a save stage that commits whatever has accumulated in one
+    transaction and runs anomaly detection on it, then through a second queue
+    to the alert stage. Thresholds are re-read on the DB thread with each
+    save, so the alert stage evaluates readings without touching the database.
+    """
+
+    def __init__(
+        self,
+        locations=MONITORED_LOCATIONS,
+        interval=POLL_INTERVAL,
+        jitter=POLL_JITTER,
+        max_inflight=MAX_INFLIGHT_FETCHES,
+    ):
+        self.locations = locations
+        self.interval = interval
+        self.jitter = jitter
+        self.max_inflight = max_inflight
+        self.evaluator = ThresholdEvaluator(check_interval=None)
+        self.alert_engine = AlertEngine(evaluator=self.evaluator)
+        self.anomaly_detector = AnomalyDetector()
+
+    def stop(self):
+        """Asks the collector to finish in-flight work and exit."""
+        if not self._stopping.is_set():
+            log("Shutdown requested; draining pipeline.")
+            self._stopping.set()
+            self._scheduler.close()
+
+    async def run(self):
+        """Runs until stop() is called or SIGTERM/SIGINT arrives."""
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._fetch_slots = asyncio.Semaphore(self.max_inflight)
+        self._scheduler = PriorityScheduler(provider_quotas.values())
+        self._save_queue = asyncio.Queue(maxsize=len(self.locations) * 2)
+        self._alert_queue = asyncio.Queue(maxsize=len(self.locations) * 2)
+        self._fetch_executor = ThreadPoolExecutor(
+            max_workers=self.max_inflight, thread_name_prefix="fetch"
+        )
+        # A single DB thread keeps one connection for the collector's lifetime
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not supported on this platform or thread
+
+        # Each location is stored as a site so its readings form their own series
+        self._site_ids = await loop.run_in_executor(
+            self._db_executor, self._register_sites
+        )
+
+        log(
+            f"Collecting from {len(self.locations)} location(s) "
+            f"every {self.interval}s."
+        )
+        pollers = [
+            asyncio.create_task(self._poll(location)) for location in self.locations
+        ]
+        dispatcher = asyncio.create_task(self._scheduler.run())
+        saver = asyncio.create_task(self._save_stage())
+        alerter = asyncio.create_task(self._alert_stage())
+
+        # Pollers exit after their in-flight fetch once stopping is set; the
+        # stop marker then flows through each stage behind the last reading.
+        await asyncio.gather(*pollers)
+        await self._save_queue.put(_STOP)
+        await asyncio.gather(saver, alerter)
+        dispatcher.cancel()
+
+        await loop.run_in_executor(self._db_executor, self.anomaly_detector.flush, True)
+        await loop.run_in_executor(self._db_executor, close_connection)
+        self._fetch_executor.shutdown()
+        self._db_executor.shutdown()
+        log("Collector stopped.")
+
+    def _save_and_detect(self, readings):
+        """Runs on the DB thread; returns each reading's anomalies."""
+        self.evaluator.refresh({data["site_id"] for data in readings})
+        save_many(readings)
+        found = [
+            self.anomaly_detector.process(data, data["site_id"]) for data in readings
+        ]
+        self.anomaly_detector.flush()
+        return found
+
+    def _register_sites(self):
+        site_ids = {
+            location["name"]: add_site(
+                location["name"], location["lat"], location["lon"]
+            )
+            for location in self.locations
+        }
+        self.evaluator.refresh(site_ids.values())
+        return site_ids
+
+    async def _sleep(self, seconds):
+        """Sleeps unless stopping; returns True if the collector is stopping."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _poll(self, location):
+        loop = asyncio.get_running_loop()
+        site_id = self._site_ids[location["name"]]
+        delay = random.uniform(0, self.interval)
+        while not await self._sleep(delay):
+            started = loop.time()
+            priority = 0 if self.alert_engine.is_alerting(site_id) else 1
+            if not await self._scheduler.acquire(priority):
+                break
+            async with self._fetch_slots:
+                try:
+                    data = await loop.run_in_executor(
+                        self._fetch_executor,
+                        fetch_and_parse_data,
+                        location["lat"],
+                        location["lon"],
+                    )
+                except Exception as e:
+                    log(f"{location['name']}: fetch failed: {e}")
+                    data = None
+            if data is not None:
+                data["site_id"] = site_id
+                await self._save_queue.put((location, data))
+
+            elapsed = loop.time() - started
+            spread = self.interval * self.jitter
+            delay = max(0.0, self.interval - elapsed + random.uniform(-spread, spread))
+
+    async def _save_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._save_queue.get()]
+            while not self._save_queue.empty():
+                batch.append(self._save_queue.get_nowait())
+            items = [item for item in batch if item is not _STOP]
+
+            anomalies = [[] for _ in items]
+            if items:
+                try:
+                    anomalies = await loop.run_in_executor(
+                        self._db_executor,
+                        self._save_and_detect,
+                        [data for _, data in items],
+                    )
+                except Exception as e:
+                    log(f"Failed to save {len(items)} reading(s): {e}")
+            for (location, data), found in zip(items, anomalies):
+                await self._alert_queue.put((location, data, found))
+
+            if len(items) != len(batch):
+                await self._alert_queue.put(_STOP)
+                return
+
+    async def _alert_stage(self):
+        while True:
+            item = await self._alert_queue.get()
+            if item is _STOP:
+                return
+            location, data, anomalies = item
+            for anomaly in anomalies:
+                log(f"{location['name']}: {format_anomaly(anomaly)}")
+            for event in self.alert_engine.process(data, site=data["site_id"]):
+                if event.kind == "raised":
+                    log(f"{location['name']}: {format_alert(event)}")
+                else:
+                    log(
+                        f"{location['name']}: CLEARED: {event.metric.capitalize()} "
+                        f"is back within limits: {event.value:.2f}"
+                    )
+
+
+def run_collector(**options):
+    """Runs the collector in the foreground until it is signalled to stop."""
+    asyncio.run(Collector(**options).run())
@@ -7,3 +7,95 @@ DEFAULT_THRESHOLDS = {
     "pm25": {"max": 12},  # µg/m³
     "pm10": {"max": 54},  # µg/m³
 }
+
+# Upper bound on concurrent provider requests during a batch fetch
+MAX_CONCURRENT_REQUESTS = 16
+
+# Provider call resilience (times in seconds)
+PROVIDER_DEADLINE = 10.0  # total budget for one call, including retries
+PROVIDER_REQUEST_TIMEOUT = 5.0  # per attempt
+PROVIDER_RETRIES = 2
+PROVIDER_BACKOFF_BASE = 0.25
+PROVIDER_BACKOFF_MAX = 2.0
+HEDGE_REQUESTS = False  # send a second request once an attempt passes p95 latency
+HEDGE_MIN_SAMPLES = 20  # latency samples needed before hedging kicks in
+BREAKER_FAILURE_THRESHOLD = 5  # consecutive failed calls before the circuit opens
+BREAKER_RESET_TIMEOUT = 30.0  # how long the circuit stays open before a probe
+
+# Provider response cache
+CACHE_GRID_DEGREES = 0.1  # lat/lon cell size; points in one cell share a response
+CACHE_TTLS = {"openweather": 600, "airvisual": 1800}  # seconds per provider
+CACHE_MAX_ENTRIES = 4096  # in-memory LRU size
+CACHE_DISK_PATH = None  # e.g. "provider_cache.db" to keep responses across restarts
+
+# SQLite connection tuning
+DB_SYNCHRONOUS = "NORMAL"  # NORMAL is durable across app crashes in WAL mode; FULL also survives power loss
+DB_CACHE_SIZE_KB = 16384  # page cache per connection
+
+# Background batch writer (group commit) for readings, see start_batch_writer
+BATCH_MAX_ROWS = 1000  # commit once this many readings are queued...
+BATCH_MAX_DELAY = 0.5  # ...or once the oldest queued reading is this many seconds old
+BATCH_QUEUE_SIZE = 10000  # save_data blocks when this many readings are waiting
+
+# Rows fetched per round trip when streaming historical data
+HISTORY_CHUNK_SIZE = 5000
+
+# Above this many raw rows, historical views switch to rollup aggregates
+HISTORY_MAX_POINTS = 2000
+
+# Rows per page in the historical data viewer
+HISTORY_PAGE_SIZE = 20
+
+# Monthly columnar files for readings moved out of SQLite (python3 main.py archive).
+# "xor" compresses values; "raw" stores fixed-width arrays read without copying.
+ARCHIVE_DIR = "archive"
+ARCHIVE_ENCODING = "xor"
+
+# Bulk import (python3 main.py import): file bytes parsed per task, and worker
+# processes (None uses every core)
+IMPORT_CHUNK_BYTES = 8 * 1024 * 1024
+IMPORT_WORKERS = None
+
+# Analytics view: trailing window for rolling stats and EWMA half-life, seconds
+ANALYTICS_WINDOW = 24 * 3600
+ANALYTICS_HALFLIFE = 3600
+
+# Readings kept in memory per site for latest/recent queries (a day at 1/min)
+RECENT_CAPACITY = 1440
+
+# Seconds between checks for thresholds changed by another process
+THRESHOLDS_CHECK_INTERVAL = 1.0
+
+# Streaming alerts
+ALERT_HYSTERESIS = 0.05  # an alert clears once the value is back past its limit by 5% of the limit
+ALERT_MIN_DURATION = 0  # seconds a breach must persist before it is raised
+
+# Streaming anomaly detection
+ANOMALY_ALPHA = 0.02  # weight of each new reading in the running mean/variance
+ANOMALY_SEASONAL_ALPHA = 0.02  # same, for each hour-of-day baseline
+ANOMALY_MIN_SAMPLES = 30  # readings needed before a baseline is trusted
+ANOMALY_Z_THRESHOLD = 4.0  # standard deviations from the baseline for an outlier
+ANOMALY_CUSUM_DRIFT = 1.0  # CUSUM slack, in standard deviations per reading
+ANOMALY_CUSUM_LIMIT = 10.0  # accumulated deviation that signals a step change
+ANOMALY_SAVE_INTERVAL = 60  # seconds between detector state saves
+
+# Pipeline instrumentation (stage timings and counters, see metrics.py)
+METRICS_ENABLED = True  # False removes the timing wrappers entirely
+METRICS_PORT = None  # e.g. 9108 to serve Prometheus text at http://host:port/metrics
+METRICS_HOST = "127.0.0.1"
+METRICS_FILE = None  # e.g. "metrics.prom" for node_exporter's textfile collector
+METRICS_FILE_INTERVAL = 15  # seconds between rewrites of METRICS_FILE
+
+# Locations polled by the headless collector (python3 main.py collect)
+MONITORED_LOCATIONS = [
+    {"name": "Tokyo", "lat": 35.6895, "lon": 139.6917},
+]
+POLL_INTERVAL = 300  # seconds between polls of each location
+POLL_JITTER = 0.1  # each wait varies by up to ±10% so locations drift apart
+MAX_INFLIGHT_FETCHES = 8  # locations being fetched at the same time
+
+# Provider call quotas; override with e.g. AIRVISUAL_CALLS_PER_DAY in .env
+PROVIDER_QUOTAS = {
+    "openweather": {"per_minute": 60, "per_day": 30000},
+    "airvisual": {"per_minute": 5, "per_day": 500},
+}
@@ -1,107 +1,1335 @@
+import atexit
+import os
+import queue
 import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from config import (
+    ARCHIVE_DIR,
+    ARCHIVE_ENCODING,
+    BATCH_MAX_DELAY,
+    BATCH_MAX_ROWS,
+    BATCH_QUEUE_SIZE,
+    DB_CACHE_SIZE_KB,
+    DB_SYNCHRONOUS,
+    HISTORY_CHUNK_SIZE,
+    HISTORY_PAGE_SIZE,
+    RECENT_CAPACITY,
+)
+from analytics import aqi_to_concentration
+from archive import read_month, write_month
+from metrics import timed
+from recent import RecentReadings, format_timestamp, parse_timestamp
 
 DB_NAME = "environmental_data.db"
 
+METRICS = ("temperature", "humidity", "co2", "co", "pm25", "pm10")
+
+# Readings saved without a site belong to the site created by the sites migration
+DEFAULT_SITE_ID = 1
+DEFAULT_SITE = ("Tokyo", 35.6895, 139.6917)
+
+INSERT_READING = """
+    INSERT INTO readings (site_id, temperature, humidity, co2, co, pm25, pm10)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# The newest readings of each site, kept in memory by save_data and save_many
+recent_readings = RecentReadings(METRICS, RECENT_CAPACITY)
+
+# Each thread keeps one open connection; sqlite3 caches prepared statements
+# per connection, so reusing it also reuses the compiled SQL.
+_local = threading.local()
+
+
+def get_connection():
+    """Returns this thread's connection to DB_NAME, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.db_name == DB_NAME:
+        return conn
+    if conn is not None:
+        conn.close()
+
+    conn = sqlite3.connect(DB_NAME, cached_statements=256)
+    # WAL lets readers run alongside the writer instead of blocking on it
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size={-DB_CACHE_SIZE_KB}")
+    _local.conn = conn
+    _local.db_name = DB_NAME
+    return conn
+
+
+def close_connection():
+    """Closes this thread's connection, if it has one."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
 
 def initialize_db():
     """Initializes the database and creates tables if they don't exist."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        # Create data table
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS readings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                temperature REAL,
+                humidity REAL,
+                co2 REAL,
+                co REAL,
+                pm25 REAL,
+                pm10 REAL
+            )
+        """
+        )
 
-    # Create data table
-    cursor.execute(
+        # Create thresholds table
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS thresholds (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                metric TEXT UNIQUE,
+                min_val REAL,
+                max_val REAL
+            )
         """
-        CREATE TABLE IF NOT EXISTS readings (
+        )
+
+    _migrate(conn)
+
+    if conn.execute("SELECT 1 FROM deferred_ddl").fetchone():
+        print("Restoring indexes and rollups after an interrupted import...")
+        with conn:
+            _restore_readings_ddl(conn)
+            _rebuild_rollups(conn)
+
+
+def _add_timestamp_index(conn):
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_readings_timestamp ON readings (timestamp)"
+    )
+
+
+# Rollup resolutions from finest to coarsest: bucket format and width in seconds
+ROLLUP_RESOLUTIONS = {
+    "minute": ("%Y-%m-%d %H:%M:00", 60),
+    "hour": ("%Y-%m-%d %H:00:00", 3600),
+    "day": ("%Y-%m-%d 00:00:00", 86400),
+}
+
+_RESOLUTION_FORMATS = " UNION ALL ".join(
+    f"SELECT '{name}' AS resolution, '{fmt}' AS format"
+    for name, (fmt, _) in ROLLUP_RESOLUTIONS.items()
+)
+_ROLLUP_UPSERT = """
+    ON CONFLICT (resolution, site_id, bucket, metric) DO UPDATE SET
+        min_val = min(min_val, excluded.min_val),
+        max_val = max(max_val, excluded.max_val),
+        sum_val = sum_val + excluded.sum_val,
+        count = count + excluded.count
+"""
+
+
+# Per-metric min/max/sum/count columns for a GROUP BY over readings,
+# numbered by position in METRICS
+_AGGREGATES = ", ".join(
+    f"min({metric}) AS min_{index}, max({metric}) AS max_{index}, "
+    f"sum({metric}) AS sum_{index}, count({metric}) AS count_{index}"
+    for index, metric in enumerate(METRICS)
+)
+_METRIC_INDEXES = " UNION ALL ".join(
+    f"SELECT '{metric}' AS metric, {index} AS i" for index, metric in enumerate(METRICS)
+)
+
+
+def _pick(field):
+    """SQL selecting metric ``m.i``'s ``field`` column from _AGGREGATES rows."""
+    cases = " ".join(
+        f"WHEN {index} THEN {field}_{index}" for index in range(len(METRICS))
+    )
+    return f"CASE m.i {cases} END"
+
+
+# Folds a range of newly inserted readings (by id) into the rollups. One pass
+# groups them into minutes with every metric's aggregates; those few rows are
+# then split per resolution and metric and upserted.
+ROLLUP_NEW_READINGS = f"""
+    WITH minutes AS (
+        SELECT site_id, strftime('{ROLLUP_RESOLUTIONS['minute'][0]}', timestamp)
+               AS bucket, {_AGGREGATES}
+        FROM readings
+        WHERE id BETWEEN ? AND ?
+        GROUP BY 1, 2
+    )
+    INSERT INTO rollups
+    SELECT r.resolution, site_id, strftime(r.format, bucket), m.metric,
+           min({_pick('min')}), max({_pick('max')}), sum({_pick('sum')}),
+           sum({_pick('count')})
+    FROM minutes
+         CROSS JOIN ({_RESOLUTION_FORMATS}) AS r
+         CROSS JOIN ({_METRIC_INDEXES}) AS m
+    WHERE true
+    GROUP BY 1, 2, 3, 4
+    HAVING sum({_pick('count')}) > 0
+    {_ROLLUP_UPSERT}
+"""
+
+
+def _create_rollups(conn):
+    # Replaces any earlier rollup schema; callers rebuild the contents
+    conn.execute("DROP TABLE IF EXISTS rollups")
+    conn.execute(
+        """
+        CREATE TABLE rollups (
+            resolution TEXT NOT NULL,
+            site_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            min_val REAL,
+            max_val REAL,
+            sum_val REAL,
+            count INTEGER,
+            PRIMARY KEY (resolution, site_id, bucket, metric)
+        ) WITHOUT ROWID
+    """
+    )
+
+
+def _add_sites(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sites (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            temperature REAL,
-            humidity REAL,
-            co2 REAL,
-            co REAL,
-            pm25 REAL,
-            pm10 REAL
+            name TEXT UNIQUE NOT NULL,
+            lat REAL,
+            lon REAL
         )
     """
     )
+    conn.execute(
+        "INSERT OR IGNORE INTO sites (id, name, lat, lon) VALUES (?, ?, ?, ?)",
+        (DEFAULT_SITE_ID, *DEFAULT_SITE),
+    )
 
-    # Create thresholds table
-    cursor.execute(
+    # Existing readings were all fetched for the default location
+    conn.execute(
+        f"ALTER TABLE readings ADD COLUMN site_id INTEGER NOT NULL "
+        f"DEFAULT {DEFAULT_SITE_ID} REFERENCES sites (id)"
+    )
+    conn.execute(
+        "CREATE INDEX idx_readings_site_timestamp ON readings (site_id, timestamp)"
+    )
+
+    # Thresholds gain an optional site; NULL rows apply to every site
+    conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS thresholds (
+        CREATE TABLE thresholds_by_site (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            metric TEXT UNIQUE,
+            site_id INTEGER REFERENCES sites (id),
+            metric TEXT NOT NULL,
             min_val REAL,
             max_val REAL
         )
     """
     )
-    conn.commit()
-    conn.close()
+    conn.execute(
+        "INSERT INTO thresholds_by_site (metric, min_val, max_val) "
+        "SELECT metric, min_val, max_val FROM thresholds"
+    )
+    conn.execute("DROP TABLE thresholds")
+    conn.execute("ALTER TABLE thresholds_by_site RENAME TO thresholds")
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_thresholds_site_metric "
+        "ON thresholds (ifnull(site_id, 0), metric)"
+    )
+
+    _create_rollups(conn)
+    _rebuild_rollups(conn)
+
+
+def _convert_aqi_readings(conn):
+    # Earlier versions stored AirVisual's US AQI as pm25 and its China AQI as
+    # pm10; convert those indexes to the concentrations the columns hold now.
+    def convert(metric, aqi, scale):
+        return round(aqi_to_concentration(metric, aqi, scale), 1)
+
+    conn.create_function("aqi_to_concentration", 3, convert, deterministic=True)
+    for metric, scale in (("pm25", "us"), ("pm10", "cn")):
+        conn.execute(
+            f"UPDATE readings SET {metric} = "
+            f"aqi_to_concentration('{metric}', {metric}, '{scale}') "
+            f"WHERE {metric} IS NOT NULL"
+        )
+    _rebuild_rollups(conn)
+
+
+def _create_anomaly_state(conn):
+    conn.execute(
+        """
+        CREATE TABLE anomaly_state (
+            site_id INTEGER NOT NULL REFERENCES sites (id),
+            metric TEXT NOT NULL,
+            state BLOB NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site_id, metric)
+        ) WITHOUT ROWID
+    """
+    )
+
+
+def _create_archive_catalog(conn):
+    conn.execute(
+        """
+        CREATE TABLE archived_months (
+            site_id INTEGER NOT NULL REFERENCES sites (id),
+            month TEXT NOT NULL,
+            path TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            PRIMARY KEY (site_id, month)
+        ) WITHOUT ROWID
+    """
+    )
+
+
+def _create_deferred_ddl(conn):
+    conn.execute(
+        """
+        CREATE TABLE deferred_ddl (
+            name TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        )
+    """
+    )
+
+
+def _create_thresholds_version(conn):
+    # Bumped with every threshold write, so processes caching thresholds
+    # (such as the collector) see changes made by any other process
+    conn.execute("CREATE TABLE thresholds_version (version INTEGER NOT NULL)")
+    conn.execute("INSERT INTO thresholds_version VALUES (0)")
+
+
+# Schema changes applied in order by initialize_db. PRAGMA user_version
+# records how many have already run, so each one runs exactly once.
+MIGRATIONS = [
+    _add_timestamp_index,
+    _create_rollups,
+    _create_thresholds_version,
+    _add_sites,
+    _convert_aqi_readings,
+    _create_anomaly_state,
+    _create_archive_catalog,
+    _create_deferred_ddl,
+]
+
+
+def _migrate(conn):
+    """Applies any migrations the database has not seen yet."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+
 
+def _reading_row(data):
+    return (data.get("site_id", DEFAULT_SITE_ID),) + tuple(
+        data.get(metric) for metric in METRICS
+    )
+
+
+def _remember_recent(row):
+    recent_readings.append(row[0], time.time(), row[1:])
+
+
+@timed("save_data")
 def save_data(data):
-    """Saves a new data reading to the database."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO readings (temperature, humidity, co2, co, pm25, pm10)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (
-        data.get("temperature"),
-        data.get("humidity"),
-        data.get("co2"),
-        data.get("co"),
-        data.get("pm25"),
-        data.get("pm10")
-    ))
-    conn.commit()
-    conn.close()
-
-def get_latest_readings():
-    """Retrieves the most recent data reading."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM readings ORDER BY timestamp DESC LIMIT 1")
+    """Saves a new data reading to the database.
+
+    The reading is stored for ``data["site_id"]``, or the default site when
+    it has none. While a batch writer is running the reading is queued for
+    its next group commit instead of being written immediately. Either way
+    it reaches recent_readings only once committed.
+    """
+    if _batch_writer is not None:
+        _batch_writer.put(data)
+        return
+    _insert_rows([_reading_row(data)])
+
+
+@timed("save_many")
+def save_many(readings):
+    """Saves many readings in a single transaction."""
+    _insert_rows([_reading_row(data) for data in readings])
+
+
+INSERT_IMPORTED = f"""
+    INSERT INTO readings (site_id, timestamp, {', '.join(METRICS)})
+    VALUES ({', '.join('?' * (len(METRICS) + 2))})
+"""
+
+
+def _defer_readings_ddl(conn):
+    """Drops the readings indexes and triggers, noting how to recreate them."""
+    statements = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE tbl_name = 'readings' AND type IN ('index', 'trigger') "
+        "AND sql IS NOT NULL"
+    ).fetchall()
+    for kind, name, sql in statements:
+        conn.execute("INSERT OR IGNORE INTO deferred_ddl VALUES (?, ?)", (name, sql))
+        conn.execute(f"DROP {kind.upper()} {name}")
+
+
+def _restore_readings_ddl(conn):
+    for name, sql in conn.execute("SELECT name, sql FROM deferred_ddl").fetchall():
+        conn.execute(sql)
+        conn.execute("DELETE FROM deferred_ddl WHERE name = ?", (name,))
+
+
+def bulk_insert_readings(chunks, progress=None):
+    """Inserts ``(site_id, timestamp, *METRICS)`` rows, one transaction per chunk.
+
+    The readings indexes are dropped for the duration and recreated at the
+    end, which builds each index in one sorted pass rather than row by row;
+    rollups are left for the caller to rebuild over the imported range. If
+    the process dies part way, initialize_db restores them on the next start.
+    ``progress`` is called with the running row count after each chunk.
+    Returns the number of rows inserted.
+    """
+    conn = get_connection()
+    with conn:
+        _defer_readings_ddl(conn)
+    total = 0
+    try:
+        for rows in chunks:
+            with conn:
+                conn.executemany(INSERT_IMPORTED, rows)
+            total += len(rows)
+            if progress is not None:
+                progress(total)
+    finally:
+        with conn:
+            _restore_readings_ddl(conn)
+    return total
+
+
+def _insert_readings(conn, rows):
+    """Inserts rows with INSERT_READING and adds them to the rollups."""
+    inserted = conn.executemany(INSERT_READING, rows).rowcount
+    if inserted > 0:
+        # The transaction holds the write lock, so the new ids are contiguous
+        last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        conn.execute(ROLLUP_NEW_READINGS, (last - inserted + 1, last))
+
+
+def _insert_rows(rows):
+    rows = list(rows)
+    conn = get_connection()
+    with conn:
+        _insert_readings(conn, rows)
+    # Only once committed, so a failed write is never served as the latest
+    for row in rows:
+        _remember_recent(row)
+
+
+class BatchWriter:
+    """Background thread that merges queued readings into group commits.
+
+    A batch is committed when it reaches ``max_rows`` or its first reading has
+    waited ``max_delay`` seconds. ``put`` blocks once ``max_queue`` readings are
+    waiting, which bounds memory and pushes back on producers. Once the writer
+    is stopped, ``put`` writes each reading directly instead.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        max_rows=BATCH_MAX_ROWS,
+        max_delay=BATCH_MAX_DELAY,
+        max_queue=BATCH_QUEUE_SIZE,
+    ):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = False
+        # Orders put against stop, so nothing is queued behind _STOP
+        self._put_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="batch-writer", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, data):
+        with self._put_lock:
+            if not self._stopped:
+                self._queue.put(data)
+                return
+        _insert_rows([_reading_row(data)])
+
+    def flush(self):
+        """Blocks until every queued reading has been committed."""
+        self._queue.join()
+
+    def stop(self):
+        """Commits everything still queued and stops the thread."""
+        with self._put_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            readings = [item for item in batch if item is not self._STOP]
+            stopping = len(readings) != len(batch)
+            try:
+                if readings:
+                    _insert_rows(map(_reading_row, readings))
+            except sqlite3.Error as e:
+                print(f"Error writing batch of {len(readings)} readings: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        close_connection()
+
+
+_batch_writer = None
+
+
+def start_batch_writer(**options):
+    """Routes save_data through a background group-commit writer.
+
+    Opt-in: nothing starts it by default. The menu saves one reading per
+    fetch and the collector already commits each batch with save_many, so it
+    is for scripts that call save_data at a high rate.
+    """
+    global _batch_writer
+    if _batch_writer is None:
+        _batch_writer = BatchWriter(**options)
+        _batch_writer.start()
+        atexit.register(stop_batch_writer)
+    return _batch_writer
+
+
+def stop_batch_writer():
+    """Flushes and stops the batch writer; save_data writes directly again."""
+    global _batch_writer
+    writer, _batch_writer = _batch_writer, None
+    if writer is not None:
+        writer.stop()
+        atexit.unregister(stop_batch_writer)
+
+
+# The connection and PRAGMA data_version recent_readings was last warmed at
+_warmed_at = None
+
+
+def get_latest_readings(site_id=DEFAULT_SITE_ID):
+    """Retrieves the most recent data reading for a site.
+
+    Served from recent_readings when it holds the site; otherwise read from
+    the database. If another connection, such as a collector process, has
+    committed since the buffers were warmed, they are warmed again first.
+    """
+    if _warmed_at is not None:
+        conn = get_connection()
+        # Reads no pages; changes only when another connection commits
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if _warmed_at != (conn, version):
+            warm_recent_readings()
+    latest = recent_readings.latest(site_id)
+    if latest is not None:
+        return latest
+    cursor = get_connection().execute(
+        "SELECT * FROM readings WHERE site_id = ? "
+        "ORDER BY timestamp DESC, id DESC LIMIT 1",
+        (site_id,),
+    )
     row = cursor.fetchone()
-    conn.close()
+    cursor.close()
     if row:
         # Return as a dictionary
         keys = [description[0] for description in cursor.description]
         return dict(zip(keys, row))
     return None
 
-def get_historical_data(start_date, end_date):
-    """Retrieves data within a specified date range."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM readings WHERE timestamp BETWEEN ? AND ?",
-        (start_date, end_date)
+
+def warm_recent_readings():
+    """Loads each site's newest readings from the database into memory."""
+    global _warmed_at
+    conn = get_connection()
+    _warmed_at = (conn, conn.execute("PRAGMA data_version").fetchone()[0])
+    columns = ", ".join(METRICS)
+    for (site_id,) in conn.execute("SELECT id FROM sites").fetchall():
+        rows = conn.execute(
+            f"SELECT timestamp, {columns} FROM readings WHERE site_id = ? "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (site_id, RECENT_CAPACITY),
+        ).fetchall()
+        rows.reverse()
+        recent_readings.replace(
+            site_id, ((parse_timestamp(row[0]),) + row[1:] for row in rows)
+        )
+
+
+def get_recent_readings(site_id=DEFAULT_SITE_ID, n=None, seconds=None):
+    """Returns a site's newest readings from memory, oldest first.
+
+    Pass ``n`` for the last n readings or ``seconds`` for a time window. The
+    data comes from recent_readings, so it covers what this process has
+    saved or warmed, and never touches the database.
+    """
+    if seconds is not None:
+        readings = recent_readings.window(site_id, seconds)
+        return readings if n is None else readings[-n:]
+    return recent_readings.last(site_id, RECENT_CAPACITY if n is None else n)
+
+
+def _bound_seconds(value, upper):
+    """Epoch seconds matching a BETWEEN bound the way SQLite compares the text.
+
+    Stored timestamps sort as strings, so a date-only upper bound excludes
+    everything after its midnight and a fractional lower bound excludes the
+    whole second it falls in.
+    """
+    text = value.isoformat(" ") if isinstance(value, datetime) else str(value)
+    if len(text) == 10:
+        seconds = parse_timestamp(text + " 00:00:00")
+        return seconds - 1 if upper else seconds
+    seconds = parse_timestamp(text[:19])
+    return seconds + 1 if len(text) > 19 and not upper else seconds
+
+
+def _archived_columns(start_date, end_date, site_id, names, newest_first=False):
+    """Yields column dicts of a site's archived readings within a date range.
+
+    One dict per archived month overlapping the range, oldest first unless
+    ``newest_first``, each holding ``timestamp`` (epoch seconds) and the
+    columns in ``names``.
+    """
+    low, high = _bound_seconds(start_date, False), _bound_seconds(end_date, True)
+    if low > high:
+        return
+    paths = get_connection().execute(
+        "SELECT path FROM archived_months "
+        "WHERE site_id = ? AND month BETWEEN ? AND ? "
+        f"ORDER BY month {'DESC' if newest_first else 'ASC'}",
+        (site_id, format_timestamp(low)[:7], format_timestamp(high)[:7]),
+    ).fetchall()
+    for (path,) in paths:
+        columns = read_month(path, names)
+        timestamps = columns["timestamp"]
+        first = timestamps.searchsorted(low, "left")
+        last = timestamps.searchsorted(high, "right")
+        if first < last:
+            yield {name: values[first:last] for name, values in columns.items()}
+
+
+def _column_rows(columns, site_id, names):
+    """Turns archived columns into row tuples of ``names`` as the table holds them."""
+    values = []
+    for name in names:
+        if name == "timestamp":
+            values.append(map(format_timestamp, columns[name].tolist()))
+        elif name == "site_id":
+            values.append([site_id] * len(columns["timestamp"]))
+        elif name == "id":
+            values.append(columns[name].tolist())
+        else:
+            # NaN marks a missing value, as NULL does in the table
+            values.append([None if v != v else v for v in columns[name].tolist()])
+    return zip(*values)
+
+
+def _archived_rows(start_date, end_date, site_id, names):
+    """Yields a site's archived readings within a date range as row tuples."""
+    for columns in _archived_columns(start_date, end_date, site_id, names):
+        yield from _column_rows(columns, site_id, names)
+
+
+def _key_position(columns, key, side):
+    """Index of a ``(timestamp, id)`` page key in archived columns.
+
+    Archive files are sorted by (timestamp, id), so this is a binary search on
+    the timestamps and then on the ids sharing the key's timestamp. ``side``
+    is passed on to searchsorted.
+    """
+    timestamp, row_id = parse_timestamp(key[0]), key[1]
+    timestamps = columns["timestamp"]
+    first = timestamps.searchsorted(timestamp, "left")
+    last = timestamps.searchsorted(timestamp, "right")
+    return first + int(columns["id"][first:last].searchsorted(row_id, side))
+
+
+def _archived_page(
+    start_date, end_date, site_id, names, limit, after=None, before=None
+):
+    """Returns up to ``limit`` archived rows for get_readings_page, oldest first.
+
+    The rows follow ``after``, or with ``before`` are the last ones preceding
+    it, or else are the first of the range.
+    """
+    if after is not None:
+        start_date = after[0]
+    if before is not None:
+        end_date = before[0]
+    pages = []
+    for columns in _archived_columns(
+        start_date, end_date, site_id, names, newest_first=before is not None
+    ):
+        first, last = 0, len(columns["timestamp"])
+        if after is not None:
+            first = _key_position(columns, after, "right")
+        if before is not None:
+            last = _key_position(columns, before, "left")
+            first = max(first, last - limit)
+        else:
+            last = min(last, first + limit)
+        if first < last:
+            page = {name: values[first:last] for name, values in columns.items()}
+            pages.append(list(_column_rows(page, site_id, names)))
+            limit -= last - first
+        if limit <= 0:
+            break
+    if before is not None:
+        pages.reverse()
+    return [row for page in pages for row in page]
+
+
+def get_historical_data(start_date, end_date, site_id=DEFAULT_SITE_ID):
+    """Retrieves a site's data within a specified date range."""
+    cursor = get_connection().execute(
+        "SELECT * FROM readings WHERE site_id = ? AND timestamp BETWEEN ? AND ?",
+        (site_id, start_date, end_date)
     )
     rows = cursor.fetchall()
-    conn.close()
     # Return as a list of dictionaries
     keys = [description[0] for description in cursor.description]
-    return [dict(zip(keys, row)) for row in rows]
+    archived = _archived_rows(start_date, end_date, site_id, keys)
+    return [dict(zip(keys, row)) for row in archived] + [
+        dict(zip(keys, row)) for row in rows
+    ]
+
+
+@lru_cache(maxsize=None)
+def _row_type(columns):
+    return namedtuple("Reading", columns)
+
+
+def iter_historical_data(
+    start_date,
+    end_date,
+    metrics=None,
+    chunk_size=HISTORY_CHUNK_SIZE,
+    site_id=DEFAULT_SITE_ID,
+):
+    """Streams a site's readings within a date range in timestamp order.
+
+    Rows are named tuples of ``id``, ``timestamp`` and the requested metric
+    columns (all metrics by default). They are fetched ``chunk_size`` at a
+    time, so memory use does not grow with the size of the range.
+    """
+    metrics = tuple(metrics) if metrics else METRICS
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metric(s): {', '.join(sorted(unknown))}")
+    columns = ("id", "timestamp") + metrics
+    make_row = _row_type(columns)._make
+
+    # Archived months are older than anything left in the table
+    yield from map(make_row, _archived_rows(start_date, end_date, site_id, columns))
+    cursor = get_connection().execute(
+        f"SELECT {', '.join(columns)} FROM readings "
+        "WHERE site_id = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp, id",
+        (site_id, start_date, end_date),
+    )
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from map(make_row, rows)
+    finally:
+        cursor.close()
 
-def get_thresholds():
-    """Retrieves the current safety thresholds."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT metric, min_val, max_val FROM thresholds")
+
+def get_historical_columns(
+    start_date, end_date, metrics=None, site_id=DEFAULT_SITE_ID
+):
+    """Loads a site's readings for a date range into NumPy arrays, one per column.
+
+    Returns a dict with a ``timestamp`` array of ``datetime64[s]`` and a
+    float64 array per metric, where missing values are NaN.
+    """
+    import numpy as np
+
+    metrics = tuple(metrics) if metrics else METRICS
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metric(s): {', '.join(sorted(unknown))}")
+
+    # Selecting the timestamp as epoch seconds keeps every column numeric, so
+    # each chunk converts to a float array in one call (None becomes NaN).
+    cursor = get_connection().execute(
+        f"SELECT CAST(strftime('%s', timestamp) AS INTEGER), {', '.join(metrics)} "
+        "FROM readings WHERE site_id = ? AND timestamp BETWEEN ? AND ? "
+        "ORDER BY timestamp, id",
+        (site_id, start_date, end_date),
+    )
+    chunks = [
+        np.column_stack([archived[name] for name in ("timestamp",) + metrics])
+        for archived in _archived_columns(start_date, end_date, site_id, metrics)
+    ]
+    while True:
+        rows = cursor.fetchmany(HISTORY_CHUNK_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+    cursor.close()
+
+    table = (
+        np.concatenate(chunks)
+        if chunks
+        else np.empty((0, len(metrics) + 1), dtype=np.float64)
+    )
+    columns = {"timestamp": table[:, 0].astype("int64").astype("datetime64[s]")}
+    for index, metric in enumerate(metrics, start=1):
+        columns[metric] = np.ascontiguousarray(table[:, index])
+    return columns
+
+
+Rollup = namedtuple("Rollup", "bucket metric min max mean count")
+
+
+def _day_floor(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _rebuild_rollups(conn, start_date=None, end_date=None):
+    everything = start_date is None or end_date is None
+    if everything:
+        lower, upper = "0000-01-01 00:00:00", "9999-12-31 23:59:59"
+    else:
+        lower = _day_floor(start_date).strftime("%Y-%m-%d %H:%M:%S")
+        upper = (_day_floor(end_date) + timedelta(days=1)).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+    # Archived months have no raw readings left, so their rollups are kept
+    has_archives = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'archived_months'"
+    ).fetchone() and conn.execute("SELECT 1 FROM archived_months").fetchone()
+
+    def live(table, column):
+        if not has_archives:
+            return ""
+        return (
+            "AND NOT EXISTS (SELECT 1 FROM archived_months AS a "
+            f"WHERE a.site_id = {table}.site_id AND a.month = substr({column}, 1, 7))"
+        )
+
+    # Naming the resolutions and sites lets each statement seek the primary
+    # key to the range instead of scanning every rollup
+    resolutions = ", ".join(f"'{name}'" for name in ROLLUP_RESOLUTIONS)
+    if everything and not has_archives:
+        conn.execute("DELETE FROM rollups")  # truncates without visiting rows
+    else:
+        conn.execute(
+            f"DELETE FROM rollups WHERE resolution IN ({resolutions}) "
+            "AND site_id IN (SELECT id FROM sites) AND bucket >= ? AND bucket < ? "
+            f"{live('rollups', 'bucket')}",
+            (lower, upper),
+        )
+
+    # Each level is first built as a temporary table with one row per site
+    # and bucket and min/max/sum/count columns for every metric: minutes from
+    # the raw readings, each coarser level from the one below. Every level is
+    # then split into a row per metric, in primary key order so the rollups
+    # B-tree is appended to rather than split.
+    coarse_aggregates = ", ".join(
+        f"min(min_{index}) AS min_{index}, max(max_{index}) AS max_{index}, "
+        f"sum(sum_{index}) AS sum_{index}, sum(count_{index}) AS count_{index}"
+        for index in range(len(METRICS))
+    )
+    metric_indexes = " UNION ALL ".join(
+        f"SELECT '{metric}' AS metric, {METRICS.index(metric)} AS i"
+        for metric in sorted(METRICS)
+    )
+
+    previous = None
+    for resolution, (bucket_format, _) in ROLLUP_RESOLUTIONS.items():
+        table = f"temp.rollup_{resolution}"
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        if previous is None:
+            conn.execute(
+                f"""
+                CREATE TABLE {table} AS
+                SELECT site_id, strftime('{bucket_format}', timestamp) AS bucket,
+                       {_AGGREGATES}
+                FROM readings
+                WHERE timestamp >= ? AND timestamp < ? {live('readings', 'timestamp')}
+                GROUP BY site_id, bucket
+            """,
+                (lower, upper),
+            )
+        else:
+            conn.execute(
+                f"""
+                CREATE TABLE {table} AS
+                SELECT site_id, strftime('{bucket_format}', bucket) AS bucket,
+                       {coarse_aggregates}
+                FROM {previous}
+                GROUP BY site_id, 2
+            """
+            )
+            conn.execute(f"DROP TABLE {previous}")
+        conn.execute(
+            f"""
+            INSERT INTO rollups
+            SELECT '{resolution}', site_id, bucket, m.metric, {_pick('min')},
+                   {_pick('max')}, {_pick('sum')}, {_pick('count')}
+            FROM {table} CROSS JOIN ({metric_indexes}) AS m
+            WHERE {_pick('count')} > 0
+        """
+        )
+        previous = table
+    conn.execute(f"DROP TABLE {previous}")
+
+
+def rebuild_rollups(start_date=None, end_date=None):
+    """Recomputes rollups from raw readings, for whole days in a range or everything."""
+    conn = get_connection()
+    with conn:
+        _rebuild_rollups(conn, start_date, end_date)
+
+
+def get_readings_page(
+    start_date,
+    end_date,
+    after=None,
+    before=None,
+    limit=HISTORY_PAGE_SIZE,
+    site_id=DEFAULT_SITE_ID,
+):
+    """Returns one page of a site's readings in a date range, oldest first.
+
+    Pages are keyed on ``(timestamp, id)``: pass the key of the last row seen
+    as ``after`` for the next page, or of the first row as ``before`` for the
+    previous one. Each page is a single index range scan, however deep into
+    the range it is, plus a binary search in the archived months it reaches.
+    """
+    # The page key narrows the timestamp range itself so the index scan
+    # starts at the key; SQLite would otherwise seek only to the range start
+    # and filter every row up to it.
+    if before is not None:
+        query = (
+            "SELECT * FROM readings WHERE site_id = ? AND timestamp BETWEEN ? AND ? "
+            "AND (timestamp < ? OR id < ?) ORDER BY timestamp DESC, id DESC"
+        )
+        params = (site_id, start_date, before[0]) + tuple(before)
+    elif after is not None:
+        query = (
+            "SELECT * FROM readings WHERE site_id = ? AND timestamp BETWEEN ? AND ? "
+            "AND (timestamp > ? OR id > ?) ORDER BY timestamp, id"
+        )
+        params = (site_id, after[0], end_date) + tuple(after)
+    else:
+        query = (
+            "SELECT * FROM readings WHERE site_id = ? AND timestamp BETWEEN ? AND ? "
+            "ORDER BY timestamp, id"
+        )
+        params = (site_id, start_date, end_date)
+    cursor = get_connection().execute(query + " LIMIT ?", params + (limit,))
     rows = cursor.fetchall()
-    conn.close()
+    keys = tuple(description[0] for description in cursor.description)
+    # Archived months are older than anything left in the table
+    if before is not None:
+        rows.reverse()
+        if len(rows) < limit:
+            rows[:0] = _archived_page(
+                start_date, end_date, site_id, keys, limit - len(rows), before=before
+            )
+    else:
+        archived = _archived_page(
+            start_date, end_date, site_id, keys, limit, after=after
+        )
+        rows = (archived + rows)[:limit]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def summarize_readings(start_date, end_date, site_id=DEFAULT_SITE_ID):
+    """Returns the row count and per-metric min/max/mean for a date range.
+
+    Computed by SQLite in one pass, plus one pass over the columns of each
+    archived month in the range. The result is a dict with ``count`` and, for
+    each metric, a ``(min, max, mean)`` tuple of None when the metric has no
+    values.
+    """
+    aggregates = ", ".join(
+        f"min({metric}), max({metric}), sum({metric}), count({metric})"
+        for metric in METRICS
+    )
+    row = get_connection().execute(
+        f"SELECT count(*), {aggregates} FROM readings "
+        "WHERE site_id = ? AND timestamp BETWEEN ? AND ?",
+        (site_id, start_date, end_date),
+    ).fetchone()
+    count = row[0]
+    stats = [list(row[1 + 4 * index : 5 + 4 * index]) for index in range(len(METRICS))]
+    for columns in _archived_columns(start_date, end_date, site_id, METRICS):
+        count += len(columns["timestamp"])
+        for stat, metric in zip(stats, METRICS):
+            values = columns[metric]
+            values = values[values == values]  # NaN marks a missing value
+            if not len(values):
+                continue
+            low, high = float(values.min()), float(values.max())
+            stat[0] = low if stat[0] is None else min(stat[0], low)
+            stat[1] = high if stat[1] is None else max(stat[1], high)
+            stat[2] = (stat[2] or 0) + float(values.sum())
+            stat[3] += len(values)
+    summary = {"count": count}
+    for metric, (low, high, total, values) in zip(METRICS, stats):
+        summary[metric] = (low, high, total / values if values else None)
+    return summary
+
+
+def choose_rollup_resolution(start_date, end_date, max_points):
+    """Returns the finest rollup resolution that yields at most ``max_points`` buckets.
+
+    Falls back to the coarsest resolution when none of them fit.
+    """
+    if isinstance(start_date, str):
+        start_date = datetime.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        end_date = datetime.fromisoformat(end_date)
+    span = max((end_date - start_date).total_seconds(), 0)
+    for name, (_, width) in ROLLUP_RESOLUTIONS.items():
+        if span / width <= max_points:
+            return name
+    return list(ROLLUP_RESOLUTIONS)[-1]
+
+
+def get_rollup_series(
+    start_date, end_date, max_points, metrics=None, site_id=DEFAULT_SITE_ID
+):
+    """Returns ``(resolution, rows)`` of a site's aggregated readings for a date range.
+
+    The resolution is picked by choose_rollup_resolution, so a long range reads
+    a few thousand rollup rows rather than every raw reading. Rows are Rollup
+    named tuples ordered by bucket then metric.
+    """
+    metrics = tuple(metrics) if metrics else METRICS
+    if isinstance(start_date, str):
+        start_date = datetime.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        # A bare end date covers the whole of that day
+        end_date = datetime.fromisoformat(
+            f"{end_date} 23:59:59" if len(end_date) == 10 else end_date
+        )
+    resolution = choose_rollup_resolution(start_date, end_date, max_points)
+    bucket_format = ROLLUP_RESOLUTIONS[resolution][0]
+    placeholders = ", ".join("?" for _ in metrics)
+    cursor = get_connection().execute(
+        f"""
+        SELECT bucket, metric, min_val, max_val, sum_val / count, count
+        FROM rollups
+        WHERE resolution = ? AND site_id = ? AND bucket BETWEEN ? AND ?
+              AND metric IN ({placeholders})
+        ORDER BY bucket, metric
+    """,
+        (
+            resolution,
+            site_id,
+            start_date.strftime(bucket_format),
+            end_date.strftime(bucket_format),
+            *metrics,
+        ),
+    )
+    return resolution, [Rollup._make(row) for row in cursor]
+
+
+def get_thresholds(site_id=None):
+    """Retrieves the current safety thresholds.
+
+    With no site, returns the global thresholds. With a site, the site's own
+    thresholds take precedence over the global ones, metric by metric.
+    """
+    rows = get_connection().execute(
+        "SELECT metric, min_val, max_val FROM thresholds "
+        "WHERE site_id IS NULL OR site_id = ? ORDER BY site_id IS NOT NULL",
+        (site_id,),
+    ).fetchall()
     thresholds = {}
-    for row in rows:
-        thresholds[row[0]] = {"min": row[1], "max": row[2]}
+    for metric, min_val, max_val in rows:
+        current = thresholds.get(metric, {})
+        thresholds[metric] = {
+            "min": min_val if min_val is not None else current.get("min"),
+            "max": max_val if max_val is not None else current.get("max"),
+        }
     return thresholds
 
-def set_threshold(metric, min_val, max_val):
-    """Sets or updates a safety threshold."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR REPLACE INTO thresholds (metric, min_val, max_val)
-        VALUES (?, ?, ?)
-    """, (metric, min_val, max_val))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+
+def thresholds_version():
+    """Returns a counter that changes whenever thresholds are written."""
+    return (
+        get_connection()
+        .execute("SELECT version FROM thresholds_version")
+        .fetchone()[0]
+    )
+
+
+def set_threshold(metric, min_val, max_val, site_id=None):
+    """Sets or updates a safety threshold, globally or for one site."""
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO thresholds (site_id, metric, min_val, max_val)
+            VALUES (?, ?, ?, ?)
+        """, (site_id, metric, min_val, max_val))
+        conn.execute("UPDATE thresholds_version SET version = version + 1")
+
+
+def update_threshold(metric, min_val=None, max_val=None, site_id=None):
+    """Changes only the given limits of a threshold, keeping any stored others."""
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+            INSERT INTO thresholds (site_id, metric, min_val, max_val)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (ifnull(site_id, 0), metric) DO UPDATE SET
+                min_val = ifnull(excluded.min_val, min_val),
+                max_val = ifnull(excluded.max_val, max_val)
+        """, (site_id, metric, min_val, max_val))
+        conn.execute("UPDATE thresholds_version SET version = version + 1")
+
+
+Site = namedtuple("Site", "id name lat lon")
+
+
+def get_sites():
+    """Returns every monitored site, ordered by id."""
+    rows = get_connection().execute("SELECT id, name, lat, lon FROM sites ORDER BY id")
+    return [Site._make(row) for row in rows]
+
+
+def get_site(site_id):
+    """Returns a site by id, or None if there is no such site."""
+    row = get_connection().execute(
+        "SELECT id, name, lat, lon FROM sites WHERE id = ?", (site_id,)
+    ).fetchone()
+    return Site._make(row) if row else None
+
+
+def add_site(name, lat, lon):
+    """Adds a site, or updates the coordinates of an existing one; returns its id."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO sites (name, lat, lon) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET lat = excluded.lat, lon = excluded.lon
+        """,
+            (name, lat, lon),
+        )
+    return conn.execute("SELECT id FROM sites WHERE name = ?", (name,)).fetchone()[0]
+
+
+def load_anomaly_state(site_id):
+    """Returns the anomaly detector's saved state blobs for a site, by metric."""
+    rows = get_connection().execute(
+        "SELECT metric, state FROM anomaly_state WHERE site_id = ?", (site_id,)
+    ).fetchall()
+    return dict(rows)
+
+
+def save_anomaly_state(states):
+    """Stores anomaly detector state from ``(site_id, metric, blob)`` rows."""
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO anomaly_state (site_id, metric, state) "
+            "VALUES (?, ?, ?)",
+            states,
+        )
+
+
+ArchivedMonth = namedtuple("ArchivedMonth", "site_id month rows path")
+
+
+def _month_range(month):
+    """Returns the first timestamps of ``month`` ("YYYY-MM") and the next month."""
+    start = datetime.strptime(month, "%Y-%m")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _load_month(conn, site_id, start, end):
+    import numpy as np
+
+    rows = conn.execute(
+        f"SELECT CAST(strftime('%s', timestamp) AS INTEGER), id, "
+        f"{', '.join(METRICS)} FROM readings "
+        "WHERE site_id = ? AND timestamp >= ? AND timestamp < ? "
+        "ORDER BY timestamp, id",
+        (site_id, start, end),
+    ).fetchall()
+    table = np.array(rows, dtype=np.float64).reshape(len(rows), len(METRICS) + 2)
+    columns = {
+        "timestamp": table[:, 0].astype(np.int64),
+        "id": table[:, 1].astype(np.int64),
+    }
+    for index, metric in enumerate(METRICS, start=2):
+        columns[metric] = np.ascontiguousarray(table[:, index])
+    return columns
+
+
+def archive_readings(
+    before, directory=ARCHIVE_DIR, encoding=ARCHIVE_ENCODING, vacuum=False
+):
+    """Moves readings from whole months before ``before`` into archive files.
+
+    Each site's month becomes one columnar file under ``directory`` (see
+    archive.py) and is recorded in archived_months; the historical readers
+    then merge it back in transparently. Rollups of archived months are kept,
+    so charts over them are unaffected. Archiving a month again (after late
+    readings arrived) merges them into a new file. With ``vacuum`` the freed
+    pages are returned to the file system afterwards. Returns an
+    ArchivedMonth per file written.
+    """
+    import numpy as np
+
+    if encoding not in ("raw", "xor"):
+        raise ValueError(f"Unknown archive encoding: {encoding}")
+    if isinstance(before, str):
+        before = datetime.fromisoformat(before)
+    cutoff = before.strftime("%Y-%m-01 00:00:00")
+
+    conn = get_connection()
+    months = conn.execute(
+        "SELECT DISTINCT site_id, substr(timestamp, 1, 7) FROM readings "
+        "WHERE timestamp < ? ORDER BY 2, 1",
+        (cutoff,),
+    ).fetchall()
+    archived = []
+    for site_id, month in months:
+        start, end = _month_range(month)
+        columns = _load_month(conn, site_id, start, end)
+        existing = conn.execute(
+            "SELECT path, generation FROM archived_months "
+            "WHERE site_id = ? AND month = ?",
+            (site_id, month),
+        ).fetchone()
+        generation = 1
+        if existing is not None:
+            old_path, generation = existing[0], existing[1] + 1
+            old = read_month(old_path)
+            columns = {
+                name: np.concatenate((old[name], values))
+                for name, values in columns.items()
+            }
+            order = np.lexsort((columns["id"], columns["timestamp"]))
+            columns = {name: values[order] for name, values in columns.items()}
+
+        # A new file per generation, so the catalog never points at a file
+        # that is still being written
+        path = os.path.join(directory, str(site_id), f"{month}.{generation}.col")
+        write_month(path, columns, encoding)
+        rows = len(columns["timestamp"])
+        with conn:
+            conn.execute(
+                "DELETE FROM readings "
+                "WHERE site_id = ? AND timestamp >= ? AND timestamp < ?",
+                (site_id, start, end),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO archived_months "
+                "(site_id, month, path, generation, rows) VALUES (?, ?, ?, ?, ?)",
+                (site_id, month, path, generation, rows),
+            )
+        if existing is not None and old_path != path:
+            os.remove(old_path)
+        archived.append(ArchivedMonth(site_id, month, rows, path))
+
+    if vacuum and archived:
+        conn.execute("VACUUM")
+    return archived
+
+
+def restore_archives(start_date=None, end_date=None, site_id=None):
+    """Moves archived months back into the readings table.
+
+    Restores the months overlapping ``start_date``..``end_date`` (all when
+    omitted), for one site or all of them, keeping the original ids, and
+    recomputes their rollups from the restored rows. Returns an
+    ArchivedMonth per file restored.
+    """
+    query = "SELECT site_id, month, rows, path FROM archived_months WHERE 1"
+    params = ()
+    if start_date is not None:
+        query += " AND month >= ?"
+        params += (str(start_date)[:7],)
+    if end_date is not None:
+        query += " AND month <= ?"
+        params += (str(end_date)[:7],)
+    if site_id is not None:
+        query += " AND site_id = ?"
+        params += (site_id,)
+
+    conn = get_connection()
+    months = [ArchivedMonth._make(row) for row in conn.execute(query, params)]
+    if not months:
+        return months
+    names = ("id", "timestamp") + METRICS + ("site_id",)
+    with conn:
+        # Rollups are rebuilt once at the end rather than row by row
+        for month in months:
+            conn.executemany(
+                f"INSERT INTO readings ({', '.join(names)}) "
+                f"VALUES ({', '.join('?' * len(names))})",
+                _column_rows(read_month(month.path), month.site_id, names),
+            )
+            conn.execute(
+                "DELETE FROM archived_months WHERE site_id = ? AND month = ?",
+                (month.site_id, month.month),
+            )
+        first = min(month.month for month in months)
+        last = max(month.month for month in months)
+        _rebuild_rollups(
+            conn,
+            _month_range(first)[0],
+            datetime.fromisoformat(_month_range(last)[1]) - timedelta(days=1),
+        )
+    for month in months:
+        os.remove(month.path)
+    return months
@@ -0,0 +1,218 @@
+import csv
+import json
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from config import IMPORT_CHUNK_BYTES, IMPORT_WORKERS
+from db_handler import (
+    DEFAULT_SITE_ID,
+    METRICS,
+    bulk_insert_readings,
+    get_sites,
+    rebuild_rollups,
+)
+from recent import format_timestamp
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+# Rejected rows described in the result, per chunk and overall
+MAX_ERRORS = 5
+
+ImportResult = namedtuple("ImportResult", "rows skipped errors seconds")
+
+
+def _timestamp(value):
+    """Normalizes a timestamp to the stored UTC 'YYYY-MM-DD HH:MM:SS' text.
+
+    Accepts that format, ISO 8601 (an offset or Z is converted to UTC) and
+    epoch seconds.
+    """
+    if isinstance(value, (int, float)):
+        return format_timestamp(value)
+    if len(value) == 19 and value[10] == " ":
+        datetime.fromisoformat(value)  # validates
+        return value
+    if value.isdigit():
+        return format_timestamp(int(value))
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(" ", "seconds")
+
+
+def _number(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def _csv_fields(header):
+    """Returns a function picking (site_id, timestamp, metrics) from a CSV line."""
+    positions = {name: index for index, name in enumerate(header)}
+    timestamp = positions["timestamp"]
+    site = positions.get("site_id")
+    metrics = [positions.get(metric) for metric in METRICS]
+
+    def fields(line):
+        record = next(csv.reader((line,)))
+        return (
+            None if site is None else record[site],
+            record[timestamp],
+            [None if index is None else record[index] for index in metrics],
+        )
+
+    return fields
+
+
+def _jsonl_fields(line):
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    return (
+        record.get("site_id"),
+        record["timestamp"],
+        [record.get(metric) for metric in METRICS],
+    )
+
+
+def _parse_range(task):
+    """Parses one byte range of an import file (runs in a worker process).
+
+    Returns ``(rows, skipped, errors, first, last)``: the valid rows ready
+    for bulk_insert_readings, the number rejected, a few error messages, and
+    the earliest and latest timestamps seen.
+    """
+    path, fmt, start, end, header, default_site, sites = task
+    with open(path, "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).splitlines()
+    fields = _csv_fields(header) if fmt == "csv" else _jsonl_fields
+
+    rows, errors = [], []
+    skipped = 0
+    first = last = None
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            # Decoded line by line, so a bad byte only costs its own row
+            line = line.decode("utf-8")
+            site, timestamp, values = fields(line)
+            site = default_site if site in (None, "") else int(site)
+            if site not in sites:
+                raise ValueError(f"unknown site {site}")
+            timestamp = _timestamp(timestamp)
+            row = (site, timestamp, *map(_number, values))
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            skipped += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"{e!r}: {line[:80]!r}")
+            continue
+        rows.append(row)
+        if first is None or timestamp < first:
+            first = timestamp
+        if last is None or timestamp > last:
+            last = timestamp
+    return rows, skipped, errors, first, last
+
+
+def _ranges(f, start, chunk_bytes):
+    """Splits the file from ``start`` into byte ranges that end on line breaks."""
+    size = os.fstat(f.fileno()).st_size
+    while start < size:
+        f.seek(min(start + chunk_bytes, size))
+        f.readline()
+        end = f.tell()
+        yield start, end
+        start = end
+
+
+def import_readings(
+    path,
+    fmt=None,
+    site_id=DEFAULT_SITE_ID,
+    workers=IMPORT_WORKERS,
+    chunk_bytes=IMPORT_CHUNK_BYTES,
+    progress=None,
+):
+    """Bulk-loads historical readings from a CSV or JSONL file.
+
+    Rows need a ``timestamp`` and may carry a ``site_id`` (``site_id`` is
+    used otherwise) and any of the metric columns; other columns are
+    ignored. CSV fields must not contain line breaks. The file is split into
+    ``chunk_bytes`` ranges parsed and validated by a pool of ``workers``
+    processes, while this process writes the parsed chunks in order through
+    bulk_insert_readings and then rebuilds rollups over the imported range.
+    ``progress`` is called with ``(rows, seconds)`` after each chunk.
+    Returns an ImportResult; invalid rows are skipped and counted. If the
+    import fails part way, the chunks already written are kept, with their
+    rollups rebuilt.
+
+    Other writers (such as the collector) should be stopped meanwhile, as
+    the readings indexes are dropped until the import ends.
+    """
+    if fmt is None:
+        fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise ValueError(f"Can't tell the format of {path}; use csv or jsonl")
+    sites = frozenset(site[0] for site in get_sites())
+    if site_id not in sites:
+        raise ValueError(f"Unknown site ID: {site_id}")
+
+    started = time.monotonic()
+    skipped, errors = 0, []
+    first = last = None  # time range of the chunks committed so far
+    writing = (None, None)  # time range of the chunk being written
+    window = 2 * (workers or os.cpu_count() or 1)
+
+    def parsed(executor, f, header, start):
+        # A bounded window of tasks keeps workers busy without reading the
+        # whole file ahead of the writer; results come back in file order.
+        pending = deque()
+        for range_start, range_end in _ranges(f, start, chunk_bytes):
+            task = (path, fmt, range_start, range_end, header, site_id, sites)
+            pending.append(executor.submit(_parse_range, task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def chunks(results):
+        nonlocal skipped, writing
+        for rows, chunk_skipped, chunk_errors, chunk_first, chunk_last in results:
+            skipped += chunk_skipped
+            errors.extend(chunk_errors[: MAX_ERRORS - len(errors)])
+            writing = (chunk_first, chunk_last)
+            yield rows
+
+    def committed(rows):
+        # bulk_insert_readings calls this once the chunk's transaction commits
+        nonlocal first, last
+        chunk_first, chunk_last = writing
+        if chunk_first is not None:
+            first = chunk_first if first is None else min(first, chunk_first)
+            last = chunk_last if last is None else max(last, chunk_last)
+        if progress is not None:
+            progress(rows, time.monotonic() - started)
+
+    try:
+        with open(path, "rb") as f:
+            header = None
+            if fmt == "csv":
+                header = next(csv.reader([f.readline().decode("utf-8-sig")]), [])
+                header = [name.strip() for name in header]
+                if "timestamp" not in header:
+                    raise ValueError(f"{path} has no timestamp column")
+            with ProcessPoolExecutor(workers) as executor:
+                rows = bulk_insert_readings(
+                    chunks(parsed(executor, f, header, f.tell())), committed
+                )
+    finally:
+        # Committed chunks stay even if a later one fails, so their rollups
+        # are rebuilt either way
+        if first is not None:
+            rebuild_rollups(first, last)
+    return ImportResult(rows, skipped, errors, time.monotonic() - started)
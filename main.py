@@ -1,23 +1,38 @@
-from cli import (
-    handle_fetch_data,
-    handle_query_historical,
-    handle_set_thresholds,
-    handle_show_latest,
-    handle_view_tips,
-    print_header,
-    print_menu,
-)
-from db_handler import initialize_db
-
-
-def main():
-    """Main function to run the Environmental Monitory system CLI."""
-    initialize_db()
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+
+# Everything else is imported by the commands that use it, so scripted calls
+# such as `latest --format json` never load rich, requests or NumPy.
+from config import ARCHIVE_ENCODING, DEFAULT_THRESHOLDS
+from db_handler import DEFAULT_SITE_ID, METRICS, initialize_db
 
+
+def run_interactive():
+    """Runs the interactive menu loop."""
+    from cli import (
+        handle_analyze_historical,
+        handle_fetch_data,
+        handle_pipeline_stats,
+        handle_query_historical,
+        handle_select_site,
+        handle_set_thresholds,
+        handle_show_latest,
+        handle_view_tips,
+        print_header,
+        print_menu,
+    )
+    from db_handler import warm_recent_readings
+
+    # Latest readings and tips are then answered from memory
+    warm_recent_readings()
     print_header()
     while True:
         print_menu()
-        choice = input("Choose (1–6): ")
+        choice = input("Choose (1–9): ")
 
         if choice == "1":
             handle_fetch_data()
@@ -26,14 +41,329 @@ def main():
         elif choice == "3":
             handle_query_historical()
         elif choice == "4":
-            handle_set_thresholds()
+            handle_analyze_historical()
         elif choice == "5":
-            handle_view_tips()
+            handle_set_thresholds()
         elif choice == "6":
+            handle_view_tips()
+        elif choice == "7":
+            handle_select_site()
+        elif choice == "8":
+            handle_pipeline_stats()
+        elif choice == "9":
             print("\nExiting. Stay safe!\n")
             break
         else:
-            print("\nInvalid choice. Please enter a number between 1 and 6.")
+            print("\nInvalid choice. Please enter a number between 1 and 9.")
+
+
+def _reading(site_id, readings):
+    """Picks the site, timestamp and metrics out of a stored reading."""
+    reading = {"site_id": site_id, "timestamp": readings.get("timestamp")}
+    reading.update((metric, readings.get(metric)) for metric in METRICS)
+    return reading
+
+
+def _print_reading(reading):
+    print(f"Site {reading['site_id']} at {reading['timestamp']}")
+    for metric in METRICS:
+        value = reading[metric]
+        print(f"  {metric}: {'N/A' if value is None else value}")
+
+
+def _latest_or_exit(site_id):
+    from db_handler import get_latest_readings
+
+    readings = get_latest_readings(site_id)
+    if not readings:
+        sys.exit(f"No readings for site {site_id}. Fetch data first.")
+    return _reading(site_id, readings)
+
+
+def run_fetch(args):
+    """Fetches, saves and checks a new reading for a site."""
+    from alerter import check_thresholds, format_alert
+    from api_handler import fetch_and_parse_data
+    from db_handler import get_site, save_data
+
+    site = get_site(args.site)
+    if site is None:
+        sys.exit(f"Unknown site ID: {args.site}")
+    try:
+        # Provider warnings go to stderr, keeping stdout to the reading itself
+        with contextlib.redirect_stdout(sys.stderr):
+            data = fetch_and_parse_data(site.lat, site.lon)
+        data["site_id"] = site.id
+        save_data(data)
+    except Exception as e:
+        sys.exit(f"Fetch failed: {e}")
+    # A plain threshold check: each run is a new process, so the alert
+    # engine's hysteresis and minimum duration would have no history to use
+    alerts = check_thresholds(data)
+
+    reading = _latest_or_exit(site.id)  # as stored, with its timestamp
+    if args.format == "json":
+        reading["alerts"] = [alert._asdict() for alert in alerts]
+        print(json.dumps(reading))
+        return
+    _print_reading(reading)
+    for alert in alerts:
+        print(format_alert(alert))
+
+
+def run_latest(args):
+    """Prints a site's most recent reading."""
+    reading = _latest_or_exit(args.site)
+    if args.format == "json":
+        print(json.dumps(reading))
+    else:
+        _print_reading(reading)
+
+
+def _write_history(rows, fmt):
+    if fmt == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(("id", "timestamp") + METRICS)
+        writer.writerows(rows)
+        return
+    separator = "[\n"
+    for row in rows:
+        sys.stdout.write(separator + json.dumps(row._asdict()))
+        separator = ",\n"
+    print("[]" if separator == "[\n" else "\n]")
+
+
+def run_history(args):
+    """Streams a site's readings between two dates as CSV or JSON."""
+    from db_handler import iter_historical_data
+
+    # A bare end date covers the whole of that day
+    end = f"{args.end} 23:59:59" if len(args.end) == 10 else args.end
+    rows = iter_historical_data(args.start, end, site_id=args.site)
+    try:
+        _write_history(rows, args.format)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader (e.g. head) stopped early; drop what is left unwritten
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+
+def run_set_threshold(args):
+    """Sets a metric's safety limits, globally or for one site."""
+    from db_handler import get_site, update_threshold
+
+    if args.min is None and args.max is None:
+        sys.exit("Give --min, --max or both.")
+    if args.site is not None and get_site(args.site) is None:
+        sys.exit(f"Unknown site ID: {args.site}")
+    update_threshold(args.metric, args.min, args.max, site_id=args.site)
+    scope = f"site {args.site}" if args.site is not None else "all sites"
+    print(f"Threshold for {args.metric} updated for {scope}.")
+
+
+def run_tips(args):
+    """Prints the alerts and health tips for a site's latest reading."""
+    from alerter import check_thresholds, format_alert
+    from tips import get_tips
+
+    reading = _latest_or_exit(args.site)
+    alerts = check_thresholds(reading)
+    tips = get_tips(alerts)
+    if args.format == "json":
+        reading["alerts"] = [alert._asdict() for alert in alerts]
+        reading["tips"] = tips
+        print(json.dumps(reading))
+        return
+    for alert in alerts:
+        print(format_alert(alert))
+    print("\n\n".join(tips))
+
+
+def main(argv=None):
+    """Main function to run the Environmental Monitory system CLI."""
+    parser = argparse.ArgumentParser(description="Environmental Monitoring System")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser(
+        "rebuild-rollups", help="recompute minute/hour/day rollups from raw readings"
+    )
+    check_range = commands.add_parser(
+        "check-range", help="report every threshold breach between two dates"
+    )
+    check_range.add_argument("start", help="start date, YYYY-MM-DD")
+    check_range.add_argument("end", help="end date, YYYY-MM-DD (inclusive)")
+    check_range.add_argument(
+        "--site", type=int, default=DEFAULT_SITE_ID, help="site ID (default: 1)"
+    )
+    collect = commands.add_parser(
+        "collect", help="poll the configured locations until stopped (SIGTERM)"
+    )
+    collect.add_argument(
+        "--interval", type=float, help="seconds between polls of each location"
+    )
+    archive = commands.add_parser(
+        "archive", help="move readings from months before a date into archive files"
+    )
+    archive.add_argument(
+        "before", help="date, YYYY-MM-DD; whole months before its month are moved"
+    )
+    archive.add_argument(
+        "--encoding",
+        choices=("raw", "xor"),
+        default=ARCHIVE_ENCODING,
+        help=f"archive file encoding (default: {ARCHIVE_ENCODING})",
+    )
+    archive.add_argument(
+        "--vacuum", action="store_true", help="shrink the database file afterwards"
+    )
+    restore = commands.add_parser(
+        "restore", help="move archived months back into the database"
+    )
+    restore.add_argument("--from", dest="start", help="first month, YYYY-MM")
+    restore.add_argument("--to", dest="end", help="last month, YYYY-MM")
+    restore.add_argument("--site", type=int, help="site ID (default: all sites)")
+    import_file = commands.add_parser(
+        "import", help="bulk-load historical readings from a CSV or JSONL file"
+    )
+    import_file.add_argument("path", help="file with a timestamp column per row")
+    import_file.add_argument(
+        "--format", choices=("csv", "jsonl"), help="default: from the file extension"
+    )
+    import_file.add_argument(
+        "--site",
+        type=int,
+        default=DEFAULT_SITE_ID,
+        help="site ID for rows without a site_id (default: 1)",
+    )
+    import_file.add_argument(
+        "--workers", type=int, help="parser processes (default: one per core)"
+    )
+    fetch = commands.add_parser(
+        "fetch",
+        help="fetch, save and check a new reading for a site (against the "
+        "thresholds only, without the alert engine's hysteresis or minimum "
+        "duration)",
+    )
+    latest = commands.add_parser("latest", help="print a site's most recent reading")
+    tips = commands.add_parser(
+        "tips", help="print health tips for a site's most recent reading"
+    )
+    for command in (fetch, latest, tips):
+        command.add_argument(
+            "--site", type=int, default=DEFAULT_SITE_ID, help="site ID (default: 1)"
+        )
+        command.add_argument("--format", choices=("text", "json"), default="text")
+    history = commands.add_parser(
+        "history", help="export a site's readings between two dates"
+    )
+    history.add_argument(
+        "--from", dest="start", required=True, help="start date, YYYY-MM-DD"
+    )
+    history.add_argument(
+        "--to", dest="end", required=True, help="end date, YYYY-MM-DD (inclusive)"
+    )
+    history.add_argument(
+        "--site", type=int, default=DEFAULT_SITE_ID, help="site ID (default: 1)"
+    )
+    history.add_argument("--format", choices=("csv", "json"), default="csv")
+    set_threshold = commands.add_parser(
+        "set-threshold", help="set a metric's safety limits"
+    )
+    set_threshold.add_argument("metric", choices=tuple(DEFAULT_THRESHOLDS))
+    set_threshold.add_argument(
+        "--min", type=float, help="lower limit (default: keep the current one)"
+    )
+    set_threshold.add_argument(
+        "--max", type=float, help="upper limit (default: keep the current one)"
+    )
+    set_threshold.add_argument(
+        "--site", type=int, help="site ID (default: all sites)"
+    )
+    args = parser.parse_args(argv)
+
+    initialize_db()
+
+    scripted = {
+        "fetch": run_fetch,
+        "latest": run_latest,
+        "history": run_history,
+        "set-threshold": run_set_threshold,
+        "tips": run_tips,
+    }
+    if args.command in scripted:
+        scripted[args.command](args)
+    elif args.command == "rebuild-rollups":
+        from db_handler import rebuild_rollups
+
+        rebuild_rollups()
+        print("Rollups rebuilt.")
+    elif args.command == "check-range":
+        from alerter import check_thresholds_range
+
+        # A bare end date covers the whole of that day
+        end = f"{args.end} 23:59:59" if len(args.end) == 10 else args.end
+        breaches_by_metric = check_thresholds_range(args.start, end, args.site)
+        for metric, breaches in breaches_by_metric.items():
+            if breaches.count:
+                print(
+                    f"{metric}: {breaches.count} breaches "
+                    f"({int(breaches.high.sum())} high, {int(breaches.low.sum())} low), "
+                    f"first {breaches.first}, last {breaches.last}"
+                )
+            else:
+                print(f"{metric}: no breaches")
+    elif args.command in ("archive", "restore"):
+        from db_handler import archive_readings, restore_archives
+
+        if args.command == "archive":
+            months = archive_readings(
+                args.before, encoding=args.encoding, vacuum=args.vacuum
+            )
+            verb = "Archived"
+        else:
+            months = restore_archives(args.start, args.end, args.site)
+            verb = "Restored"
+        for month in months:
+            print(f"Site {month.site_id} {month.month}: {month.rows} readings")
+        print(f"{verb} {len(months)} month(s).")
+    elif args.command == "import":
+        from concurrent.futures.process import BrokenProcessPool
+
+        from importer import import_readings
+
+        def show_progress(rows, seconds):
+            rate = rows / seconds if seconds else 0
+            print(f"\rImported {rows:,} rows ({rate:,.0f} rows/s)", end="", flush=True)
+
+        try:
+            result = import_readings(
+                args.path,
+                fmt=args.format,
+                site_id=args.site,
+                workers=args.workers,
+                progress=show_progress,
+            )
+        except (OSError, ValueError, BrokenProcessPool) as e:
+            sys.exit(f"Import failed: {e}")
+        print(
+            f"\nImported {result.rows:,} rows in {result.seconds:.1f}s "
+            f"({result.rows / max(result.seconds, 1e-9):,.0f} rows/s), "
+            f"skipped {result.skipped:,}."
+        )
+        for error in result.errors:
+            print(f"  skipped: {error}")
+    elif args.command == "collect":
+        from collector import run_collector
+        from metrics import start_exporters
+
+        start_exporters()
+        options = {"interval": args.interval} if args.interval else {}
+        run_collector(**options)
+    else:
+        from metrics import start_exporters
+
+        start_exporters()
+        run_interactive()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+import atexit
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from config import (
+    METRICS_ENABLED,
+    METRICS_FILE,
+    METRICS_FILE_INTERVAL,
+    METRICS_HOST,
+    METRICS_PORT,
+)
+
+PREFIX = "ems"
+
+# Histogram bucket upper bounds in seconds: four per doubling from 10µs to
+# about a minute, so percentiles read from them are within ~10%.
+BUCKETS = tuple(1e-5 * 2 ** (step / 4) for step in range(91))
+
+# Help text for the counters the pipeline increments
+COUNTERS = {
+    "errors_total": "Calls to a pipeline stage that raised or returned no data.",
+    "missing_fields_total": "Metrics missing (None) from a fetched reading.",
+    "cache_hits_total": "Provider responses served from the cache.",
+    "cache_misses_total": "Provider responses fetched because the cache had none.",
+}
+
+
+class Histogram:
+    """Counts of observed durations per bucket, with their sum and count."""
+
+    __slots__ = ("counts", "sum", "count", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self):
+        """Returns a consistent ``(counts, sum, count)``."""
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def percentile(self, fraction):
+        """Estimates a percentile (0–1) by interpolating within its bucket."""
+        counts, _, total = self.snapshot()
+        if not total:
+            return None
+        rank = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                low = BUCKETS[index - 1] if index else 0.0
+                high = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+_histograms = {}  # stage -> Histogram
+_counters = {}  # (name, label, value) -> count
+_lock = threading.Lock()
+
+
+def _histogram(stage):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    return histogram
+
+
+def timed(stage):
+    """Decorator recording each call's duration under ``stage``.
+
+    A call that raises also counts as an error for the stage. With
+    METRICS_ENABLED off the function is returned undecorated, so there is
+    no overhead at all.
+    """
+
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+        histogram = _histogram(stage)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                increment("errors_total", stage=stage)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorate
+
+
+def increment(name, amount=1, **label):
+    """Adds to a counter from COUNTERS, labelled by one ``key=value``."""
+    if not METRICS_ENABLED:
+        return
+    ((key, value),) = label.items()
+    with _lock:
+        _counters[(name, key, value)] = _counters.get((name, key, value), 0) + amount
+
+
+def stage_summary(fractions=(0.5, 0.95, 0.99)):
+    """Returns ``{stage: (calls, errors, {fraction: seconds})}`` for each stage."""
+    with _lock:
+        stages = dict(_histograms)
+        errors = {
+            value: count
+            for (name, _, value), count in _counters.items()
+            if name == "errors_total"
+        }
+    return {
+        stage: (
+            histogram.count,
+            errors.get(stage, 0),
+            {fraction: histogram.percentile(fraction) for fraction in fractions},
+        )
+        for stage, histogram in sorted(stages.items())
+    }
+
+
+def counters():
+    """Returns ``{(name, label, value): count}`` for every counter."""
+    with _lock:
+        return dict(_counters)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = [
+        f"# HELP {PREFIX}_stage_seconds Time spent in each pipeline stage.",
+        f"# TYPE {PREFIX}_stage_seconds histogram",
+    ]
+    with _lock:
+        stages = sorted(_histograms.items())
+        counter_values = sorted(_counters.items())
+    for stage, histogram in stages:
+        counts, total, count = histogram.snapshot()
+        label = f'stage="{_label(stage)}"'
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, counts):
+            cumulative += bucket
+            le = f'le="{bound:.6g}"'
+            lines.append(f"{PREFIX}_stage_seconds_bucket{{{label},{le}}} {cumulative}")
+        lines.append(f'{PREFIX}_stage_seconds_bucket{{{label},le="+Inf"}} {count}')
+        lines.append(f"{PREFIX}_stage_seconds_sum{{{label}}} {total:.9g}")
+        lines.append(f"{PREFIX}_stage_seconds_count{{{label}}} {count}")
+
+    for name, help_text in COUNTERS.items():
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        for (counter, key, value), count in counter_values:
+            if counter == name:
+                lines.append(f'{PREFIX}_{name}{{{key}="{_label(value)}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """Writes the metrics to ``path``, replacing it in one step."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(temp_path, path)
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serves /metrics over HTTP from a daemon thread; returns the server."""
+    # Imported here: http.server is slow to load, and most runs never serve
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would otherwise print over the CLI
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def start_exporters():
+    """Starts the configured exports: the HTTP endpoint and the metrics file.
+
+    The file is rewritten every METRICS_FILE_INTERVAL seconds and once more
+    at exit.
+    """
+    if not METRICS_ENABLED:
+        return
+    if METRICS_PORT:
+        try:
+            serve_metrics(METRICS_PORT, METRICS_HOST)
+        except OSError as e:
+            print(f"Could not serve metrics on port {METRICS_PORT}: {e}")
+    if METRICS_FILE:
+
+        def write_periodically():
+            while True:
+                time.sleep(METRICS_FILE_INTERVAL)
+                write_prometheus(METRICS_FILE)
+
+        threading.Thread(
+            target=write_periodically, name="metrics-file", daemon=True
+        ).start()
+        atexit.register(write_prometheus, METRICS_FILE)
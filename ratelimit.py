@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+# Reserved calls that go unused for this long (e.g. served from cache) lapse,
+# so saved-up reservations can't later burst past the per-minute limit.
+RESERVATION_TTL = 60.0
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second up to ``capacity``."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until one token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class ProviderQuota:
+    """Per-minute and per-day call limits for one provider.
+
+    The daily bucket holds at most a minute's worth of calls, so the daily
+    quota is spread evenly across the day instead of being spent in a burst.
+    Tokens can be reserved ahead of time by a scheduler; acquire() spends an
+    unexpired reservation before taking a fresh token.
+    """
+
+    def __init__(self, name, per_minute, per_day):
+        self.name = name
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self._buckets = (
+            TokenBucket(per_minute / 60, per_minute),
+            TokenBucket(per_day / 86400, min(per_minute, per_day)),
+        )
+        self._reserved = deque()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time(self, now):
+        blocked = max(0.0, self._blocked_until - now)
+        return max(blocked, *(bucket.wait_time(now) for bucket in self._buckets))
+
+    def time_until_available(self):
+        """Seconds until a call could be made without exceeding the quota."""
+        with self._lock:
+            return self._wait_time(time.monotonic())
+
+    def reserve(self):
+        """Takes a token now for a call that will be made shortly."""
+        with self._lock:
+            for bucket in self._buckets:
+                bucket.take()
+            self._reserved.append(time.monotonic() + RESERVATION_TTL)
+
+    def acquire(self, timeout):
+        """Waits up to ``timeout`` seconds for a call slot; returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._reserved:
+                    if self._reserved.popleft() > now:
+                        return True
+                wait = self._wait_time(now)
+                if wait == 0:
+                    for bucket in self._buckets:
+                        bucket.take()
+                    return True
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def block_for(self, seconds):
+        """Stops handing out calls for a while, e.g. after an HTTP 429."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._reserved.clear()
+
+
+class PriorityScheduler:
+    """Admits fetches one at a time, highest priority first, as quota allows.
+
+    Lower ``priority`` values go first; ties are served in arrival order. Each
+    admission reserves one call on every quota, so a fetch never starts
+    unless all providers can take it.
+    """
+
+    def __init__(self, quotas):
+        self.quotas = list(quotas)
+        self._waiters = []
+        self._order = itertools.count()
+        self._has_waiters = asyncio.Event()
+        self._closed = False
+
+    async def acquire(self, priority):
+        """Waits for a turn; returns False if the scheduler was closed."""
+        if self._closed:
+            return False
+        turn = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), turn))
+        self._has_waiters.set()
+        return await turn
+
+    def close(self):
+        """Releases every waiter with False and refuses new ones."""
+        self._closed = True
+        while self._waiters:
+            _, _, turn = heapq.heappop(self._waiters)
+            if not turn.done():
+                turn.set_result(False)
+        self._has_waiters.set()
+
+    async def run(self):
+        """Dispatch loop; run it as a task alongside the callers."""
+        while not self._closed:
+            await self._has_waiters.wait()
+            if not self._waiters:
+                self._has_waiters.clear()
+                continue
+            delay = max(quota.time_until_available() for quota in self.quotas)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, turn = heapq.heappop(self._waiters)
+            if turn.done():
+                continue
+            for quota in self.quotas:
+                quota.reserve()
+            turn.set_result(True)
@@ -0,0 +1,147 @@
+import calendar
+import math
+import threading
+import time
+from array import array
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_timestamp(value):
+    """Converts a stored UTC timestamp string to seconds since the epoch."""
+    return calendar.timegm(time.strptime(value, TIMESTAMP_FORMAT))
+
+
+def format_timestamp(seconds):
+    """Formats seconds since the epoch the way the readings table stores them."""
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of one site's readings, one array per metric.
+
+    Every column is preallocated as an ``array('d')`` of ``capacity`` slots, so
+    memory is ``8 * capacity * (len(metrics) + 1)`` bytes however many readings
+    arrive. Missing values are stored as NaN.
+    """
+
+    __slots__ = (
+        "metrics",
+        "capacity",
+        "timestamps",
+        "columns",
+        "head",
+        "size",
+        "newest",
+    )
+
+    def __init__(self, metrics, capacity):
+        self.metrics = metrics
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.columns = tuple(array("d", bytes(8 * capacity)) for _ in metrics)
+        self.head = 0  # slot the next reading goes into
+        self.size = 0
+        self.newest = None  # the newest reading as a dict, built on first read
+
+    def append(self, timestamp, values):
+        slot = self.head
+        self.timestamps[slot] = timestamp
+        for column, value in zip(self.columns, values):
+            column[slot] = math.nan if value is None else value
+        self.head = (slot + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        self.newest = None
+
+    def _slot(self, age):
+        """Slot of the reading ``age`` places back from the newest (0)."""
+        return (self.head - 1 - age) % self.capacity
+
+    def reading(self, age):
+        slot = self._slot(age)
+        reading = {"timestamp": format_timestamp(self.timestamps[slot])}
+        for metric, column in zip(self.metrics, self.columns):
+            value = column[slot]
+            reading[metric] = None if value != value else value
+        return reading
+
+    def count_since(self, cutoff):
+        """Number of newest readings stamped at or after ``cutoff``."""
+        count = 0
+        while count < self.size and self.timestamps[self._slot(count)] >= cutoff:
+            count += 1
+        return count
+
+
+class RecentReadings:
+    """Per-site ring buffers answering recent-data queries from memory.
+
+    The buffers only see readings saved by this process and those loaded when
+    warmed, so a collector running in another process is not reflected until
+    the next warm-up.
+    """
+
+    def __init__(self, metrics, capacity):
+        self.metrics = metrics
+        self.capacity = capacity
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, site_id):
+        buffer = self._buffers.get(site_id)
+        if buffer is None:
+            buffer = self._buffers[site_id] = RingBuffer(self.metrics, self.capacity)
+        return buffer
+
+    def append(self, site_id, timestamp, values):
+        """Adds a reading (metric values in ``metrics`` order) for a site."""
+        with self._lock:
+            self._buffer(site_id).append(timestamp, values)
+
+    def replace(self, site_id, rows):
+        """Refills a site's buffer from ``(timestamp, *values)`` rows, oldest first."""
+        buffer = RingBuffer(self.metrics, self.capacity)
+        for row in rows:
+            buffer.append(row[0], row[1:])
+        with self._lock:
+            self._buffers[site_id] = buffer
+
+    def latest(self, site_id):
+        """Returns the newest reading for a site as a dict, or None."""
+        with self._lock:
+            buffer = self._buffers.get(site_id)
+            if buffer is None or not buffer.size:
+                return None
+            if buffer.newest is None:
+                buffer.newest = buffer.reading(0)
+                buffer.newest["site_id"] = site_id
+            return dict(buffer.newest)
+
+    def _newest(self, site_id, n=None, cutoff=None):
+        with self._lock:
+            buffer = self._buffers.get(site_id)
+            if buffer is None:
+                return []
+            count = buffer.size if cutoff is None else buffer.count_since(cutoff)
+            if n is not None:
+                count = min(n, count)
+            readings = [buffer.reading(age) for age in range(count)]
+        for reading in readings:
+            reading["site_id"] = site_id
+        readings.reverse()
+        return readings
+
+    def last(self, site_id, n):
+        """Returns up to ``n`` of a site's newest readings, oldest first."""
+        return self._newest(site_id, n=n)
+
+    def window(self, site_id, seconds, now=None):
+        """Returns a site's readings from the last ``seconds``, oldest first."""
+        if now is None:
+            now = time.time()
+        return self._newest(site_id, cutoff=now - seconds)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import (
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_REQUESTS,
+    MAX_CONCURRENT_REQUESTS,
+    PROVIDER_BACKOFF_BASE,
+    PROVIDER_BACKOFF_MAX,
+    PROVIDER_DEADLINE,
+    PROVIDER_REQUEST_TIMEOUT,
+    PROVIDER_RETRIES,
+)
+
+
+class ProviderUnavailable(Exception):
+    """Raised when a provider call gives up without a usable response."""
+
+
+class CircuitOpenError(ProviderUnavailable):
+    """Raised when a provider's circuit breaker is rejecting calls."""
+
+
+class DeadlineExceeded(ProviderUnavailable):
+    """Raised when a provider call runs out of time across all attempts."""
+
+
+class RateLimited(ProviderUnavailable):
+    """Raised when a provider's call quota has no capacity in time."""
+
+
+class CircuitBreaker:
+    """Fails fast once a provider has failed repeatedly, then probes it again."""
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a call may be attempted right now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                self._probing = False
+            # Half-open: let exactly one probe through
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        """Gives up a half-open probe slot without recording an outcome."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Keeps a sliding window of recent call latencies."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        """Returns the given latency percentile, or None with too few samples."""
+        samples = sorted(self._samples)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+_hedge_executor = None
+
+
+def get_breaker(name):
+    """Returns the circuit breaker for a provider."""
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+            )
+            _latencies[name] = LatencyTracker()
+        return _breakers[name]
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    with _registry_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix="hedge"
+            )
+        return _hedge_executor
+
+
+def _timed(request, timeout, tracker):
+    started = time.monotonic()
+    result = request(timeout)
+    tracker.record(time.monotonic() - started)
+    return result
+
+
+def _attempt(request, remaining, tracker, hedge):
+    """Runs one attempt, racing a second copy if the first exceeds p95."""
+    timeout = min(PROVIDER_REQUEST_TIMEOUT, remaining)
+    budget = tracker.percentile(0.95) if hedge else None
+    if budget is None or budget >= remaining:
+        return _timed(request, timeout, tracker)
+
+    executor = _get_hedge_executor()
+    futures = {executor.submit(_timed, request, timeout, tracker)}
+    done, _ = wait(futures, timeout=budget)
+    if not done:
+        futures.add(executor.submit(_timed, request, timeout, tracker))
+    started = time.monotonic()
+    while futures:
+        done, futures = wait(
+            futures,
+            timeout=max(0.0, remaining - budget - (time.monotonic() - started)),
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            raise DeadlineExceeded("request did not complete before the deadline")
+        for future in done:
+            if future.exception() is None or not futures:
+                return future.result()
+    raise DeadlineExceeded("request did not complete before the deadline")
+
+
+def call_with_resilience(name, request, is_retryable, deadline=PROVIDER_DEADLINE):
+    """Calls ``request(timeout)`` under the provider's deadline, retry and breaker policy.
+
+    Errors for which ``is_retryable`` returns False are re-raised at once and
+    do not count against the breaker.
+    """
+    breaker = get_breaker(name)
+    if not breaker.allow():
+        raise CircuitOpenError(f"{name} circuit is open; skipping request.")
+    tracker = _latencies[name]
+
+    deadline_at = time.monotonic() + deadline
+    last_error = None
+    for attempt in range(PROVIDER_RETRIES + 1):
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            result = _attempt(request, remaining, tracker, HEDGE_REQUESTS)
+        except RateLimited:
+            # Running out of quota says nothing about the provider's health
+            breaker.release()
+            raise
+        except Exception as e:
+            if not isinstance(e, DeadlineExceeded) and not is_retryable(e):
+                # The provider answered, so it is up even if the request was bad
+                breaker.record_success()
+                raise
+            last_error = e
+        else:
+            breaker.record_success()
+            return result
+
+        # Full jitter keeps many clients from retrying in lockstep
+        delay = random.uniform(
+            0, min(PROVIDER_BACKOFF_MAX, PROVIDER_BACKOFF_BASE * 2**attempt)
+        )
+        if time.monotonic() + delay >= deadline_at:
+            break
+        time.sleep(delay)
+
+    breaker.record_failure()
+    if last_error is None or isinstance(last_error, DeadlineExceeded):
+        raise DeadlineExceeded(f"{name} did not respond within {deadline:.1f}s.")
+    raise last_error
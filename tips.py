@@ -58,13 +58,7 @@ def get_tips(alerts):
 
     tips = set()  # Use a set to avoid duplicate tips
     for alert in alerts:
-        # Example alert: "ALERT: Temperature is too high: 38.50 > 35"
-        parts = alert.split(" ")
-        metric = parts[1].lower()
-        condition = "high" if "high" in alert else "low"
-
-        tip_key = f"{condition}_{metric}"
-        if tip_key in HEALTH_TIPS:
-            tips.add(HEALTH_TIPS[tip_key])
+        if alert.tip_key in HEALTH_TIPS:
+            tips.add(HEALTH_TIPS[alert.tip_key])
 
     return sorted(list(tips)) if tips else [HEALTH_TIPS["default"]]